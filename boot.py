@@ -0,0 +1,43 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+## Documentation is available at https://github.com/DPHacks/picow-air
+
+# The sample log (LOG_ENABLED in settings.toml) and the MQTT spill file
+# (MQTT_SPILL) need code.py to be able to write to the CIRCUITPY drive.
+# CircuitPython only allows that while the drive is read-only over USB.
+# To edit the files over USB again, connect GP10 to GND and restart the board.
+
+import os
+import board
+import storage
+from digitalio import DigitalInOut, Pull
+
+if os.getenv('LOG_ENABLED') or os.getenv('MQTT_SPILL'):
+    usb_switch = DigitalInOut(board.GP10)
+    usb_switch.pull = Pull.UP
+    if usb_switch.value:
+        storage.remount("/", readonly=False)
+    usb_switch.deinit()
@@ -27,17 +27,32 @@
 ## Make sure to edit the settings.toml file with WiFi credentials
 
 import os
+import gc
 import time
 import sys
+import array
+import asyncio
 #import ipaddress
 import wifi
 import socketpool
 import json
+from errno import EAGAIN, EEXIST
 import board
 import busio
 from digitalio import DigitalInOut, Direction, Pull
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
 import dphacks_usaqi as USAQI
+import dphacks_sample as SAMPLE
+from dphacks_sample import Sample
+from dphacks_smooth import Smoother
+from dphacks_cache import SampleCache
+from dphacks_history import History
+from dphacks_log import SampleLog
+import dphacks_payload as PAYLOAD
+from dphacks_outbox import Outbox, Backoff
+from dphacks_deadband import Deadband
+from dphacks_assets import Assets
+from dphacks_metrics import Metrics
 
 import adafruit_ahtx0
 from adafruit_httpserver import (
@@ -46,8 +61,17 @@ from adafruit_httpserver import (
     Response,
     FileResponse,
     JSONResponse,
+    SSEResponse,
+    ChunkedResponse,
+    MIMETypes,
+    Route,
+    Status,
     GET,
-    POST
+    POST,
+    NO_REQUEST,
+    BAD_REQUEST_400,
+    NOT_FOUND_404,
+    SERVICE_UNAVAILABLE_503
 )
 
 # getenv variables are setup in the ***setting.toml*** file
@@ -59,6 +83,15 @@ MQTT_PORT = os.getenv('MQTT_PORT')
 MQTT_ISTLS = os.getenv('MQTT_ISTLS')
 MQTT_USERNAME = os.getenv('MQTT_USERNAME')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
+MQTT_BATCH = os.getenv('MQTT_BATCH', 1)
+MQTT_ENCODING = os.getenv('MQTT_ENCODING', PAYLOAD.JSON)
+MQTT_QUEUE = os.getenv('MQTT_QUEUE', 20)
+MQTT_SPILL = os.getenv('MQTT_SPILL', 0)
+MQTT_SPILL_PATH = os.getenv('MQTT_SPILL_PATH', '/spool/mqtt.bin')
+MQTT_DRAIN_RATE = os.getenv('MQTT_DRAIN_RATE', 2)
+MQTT_BACKOFF_MAX = os.getenv('MQTT_BACKOFF_MAX', 300)
+MQTT_DEADBAND = os.getenv('MQTT_DEADBAND', '')
+MQTT_KEYFRAME = os.getenv('MQTT_KEYFRAME', 12)
 
 INTERVAL = os.getenv('INTERVAL')
 
@@ -71,9 +104,39 @@ LED_G_HIGH_THRESHOLD = os.getenv('LED_G_HIGH_THRESHOLD')
 
 C_TO_F = os.getenv('C_TO_F')
 SMOOTH = os.getenv('SMOOTH')
+SAMPLE_MAX_AGE = os.getenv('SAMPLE_MAX_AGE', 2 * INTERVAL + 5)
+PM_MODE = os.getenv('PM_MODE', 'passive')
+PM_RESET_AFTER = os.getenv('PM_RESET_AFTER', 3)
+PM_DUTY_CYCLE = os.getenv('PM_DUTY_CYCLE', 0)
+PM_WARMUP = os.getenv('PM_WARMUP', 30)
+SSE_MAX_STREAMS = os.getenv('SSE_MAX_STREAMS', 2)
+HISTORY_FIELDS = os.getenv('HISTORY_FIELDS', 'pm25 env,pm100 env,temperature,humidity')
+HISTORY_RAW = os.getenv('HISTORY_RAW', 120)
+HISTORY_MINUTES = os.getenv('HISTORY_MINUTES', 120)
+HISTORY_HOURS = os.getenv('HISTORY_HOURS', 48)
+LOG_ENABLED = os.getenv('LOG_ENABLED', 0)
+LOG_PATH = os.getenv('LOG_PATH', '/log/samples.bin')
+LOG_MAX_SIZE = os.getenv('LOG_MAX_SIZE', 131072)
+ASSET_MAX_RAM = os.getenv('ASSET_MAX_RAM', 16384)
+ASSET_MAX_AGE = os.getenv('ASSET_MAX_AGE', 86400)
 
 VERSION = 1.3
 
+# How often (in seconds) each task runs
+PM_POLL_PERIOD = 0.2
+HTTP_POLL_PERIOD = 0.05
+MQTT_POLL_PERIOD = 0.5
+LED_PERIOD = 0.1
+
+# The broker drops a client that sent nothing for 1.5 times MQTT_KEEP_ALIVE
+# seconds, so the board pings it every half of that. The MQTT client blocks
+# the other tasks while it connects or waits for the broker: MQTT_SOCKET_TIMEOUT
+# bounds the TCP connect and each read, MQTT_RECV_TIMEOUT the wait for the
+# CONNACK or PINGRESP answer.
+MQTT_KEEP_ALIVE = 60
+MQTT_SOCKET_TIMEOUT = 1
+MQTT_RECV_TIMEOUT = 3
+
 ### PIN DEFINITIONS ###
 ## PICO LED
 led = DigitalInOut(board.LED)
@@ -99,9 +162,41 @@ board_led_g.direction = Direction.OUTPUT
 print('Setting up PM Sensor...')
 from pms5003 import PMS5003
 
-pm25 = PMS5003()
-time.sleep(0.1)
-pm25.cmd_mode_passive()
+# The sensor reset and the switch to PM_MODE run in the background,
+# they are carried out by pm25.update() in the sample task
+pm25 = PMS5003(mode=PM_MODE, wait_for_reset=False)
+
+# Seconds to wait for the PMS5003 to answer a passive read request
+PM_READ_TIMEOUT = 5
+# Intervals in a row without PM data
+pm_failures = 0
+
+# With PM_DUTY_CYCLE the PMS5003 sleeps between measurements. It is woken up
+# PM_WARMUP seconds before it is needed and the frames it sends while warming
+# up are dropped. In active mode the frames of the last PM_SAMPLE_TIME seconds
+# of the interval are averaged. Sleeping for less than PM_MIN_SLEEP seconds
+# isn't worth it, shorter intervals keep the sensor on.
+PM_SAMPLE_TIME = 10
+PM_MIN_SLEEP = 20
+PHASE_ON = 'on'
+PHASE_SLEEP = 'sleep'
+PHASE_WARMUP = 'warmup'
+PHASE_SAMPLE = 'sample'
+# Seconds the sensor is awake before each measurement
+pm_awake_time = PM_WARMUP + (PM_SAMPLE_TIME if PM_MODE == 'active' else 0)
+pm_duty_cycle = False
+if PM_DUTY_CYCLE:
+    if INTERVAL >= pm_awake_time + PM_MIN_SLEEP:
+        pm_duty_cycle = True
+    else:
+        print("PM_DUTY_CYCLE needs an INTERVAL of at least", pm_awake_time + PM_MIN_SLEEP,
+              "seconds, the PM sensor stays on")
+pm_phase = PHASE_ON
+pm_warmup_frames = 0
+
+# Running sums of the PMS5003 frames received during the current interval
+pm_sums = array.array('L', [0] * SAMPLE.PM_COUNT)
+pm_frames = 0
 
 print('Sensor Setup!')
 
@@ -117,72 +212,211 @@ except RuntimeError:
 if i2c:
     th = adafruit_ahtx0.AHTx0(i2c) # Comment this line if not using AHT20
 
-avgDict = {}
+# Latest readings and their smoothed averages. The records are reused for
+# every measurement, dictionaries are only built when sending JSON.
+sample = Sample()
+averaged = Sample()
+
+# Last SMOOTH values of every measurement
+avgStore = Smoother(SMOOTH, SAMPLE.NUM_FIELDS, SAMPLE.SCALES)
+
+# Allocate the AQI lookup tables while the heap is still in one piece
+USAQI.build_tables()
+
+# Hourly PM2.5 averages for the NowCast AQI, as reported by AirNow
+nowcast = USAQI.NowCast()
+
+# History of the HISTORY_FIELDS measurements served by /history
+history_fields = []
+for name in HISTORY_FIELDS.split(','):
+    name = name.strip()
+    index = SAMPLE.field_index(name)
+    if index is None:
+        print("Unknown HISTORY_FIELDS measurement:", name)
+    else:
+        history_fields.append((name, index))
+history = History(history_fields, HISTORY_RAW, HISTORY_MINUTES, HISTORY_HOURS)
+# /history output is sent in pieces of this size
+history_buffer = bytearray(512)
+print('History uses', history.bytes(), 'bytes')
+
+def make_parent_dir(path):
+    """
+    Create the folder of a file on the CIRCUITPY drive if it doesn't exist.
+    Fails with EROFS if boot.py didn't make the drive writable.
+    """
+    try:
+        os.mkdir(path[:path.rfind('/')])
+    except OSError as e:
+        if e.errno != EEXIST:
+            raise
+
+# Log of every sample record on flash, see boot.py
+sample_log = None
+if LOG_ENABLED:
+    try:
+        make_parent_dir(LOG_PATH)
+        sample_log = SampleLog(LOG_PATH, LOG_MAX_SIZE)
+    except OSError as e:
+        print("Sample log disabled, the drive is not writable:", e)
 
 ### SENSOR METHODS ###
 def read_all():
     """
-    Read all sensor data and return a single dictionary
+    Read all sensor data into the sample record. PM data is averaged
+    over the last interval by finish_pms25.
     """
-    data = {}
-    data = merge_dicts(read_pms25(), data)
-    data = merge_dicts(read_temp_hum(), data) # Comment this line if not using AHT20
+    start = metric_sensor_read.start()
+    read_temp_hum() # Comment this line if not using AHT20
+    metric_sensor_read.done(start)
 
-    return data
+    return sample
 
-def read_pms25():
+def poll_pms25():
     """
-    Read air quality information from PMS5003
+    Collect every PMS5003 data frame that has arrived and add it to the running
+    sums for the current interval. In active mode the sensor streams a frame about
+    every second, so each interval is averaged over all of them.
+    With PM_DUTY_CYCLE, frames that arrive while the sensor should be asleep
+    or is warming up are dropped.
+    This never waits on the sensor. Returns the number of new frames.
     """
-    pmvalues = {}
-    pmdata = {}
+    global pm_frames, pm_warmup_frames
+    count = 0
 
-    try:
-        pmdata = pm25.read()
-    except RuntimeError:
-        print("Unable to read PM2.5 Data")
-        # pm25.reset()
-
-    if(pmdata):
-        pmvalues['pm10 standard'] = pmdata.data[0]
-        pmvalues['pm25 standard'] = pmdata.data[1]
-        pmvalues['pm100 standard'] = pmdata.data[2]
-        pmvalues['pm10 env'] = pmdata.data[3]
-        pmvalues['pm25 env'] = pmdata.data[4]
-        pmvalues['pm100 env'] = pmdata.data[5]
-        pmvalues['particles 03um'] = pmdata.data[6]
-        pmvalues['particles 05um'] = pmdata.data[7]
-        pmvalues['particles 10um'] = pmdata.data[8]
-        pmvalues['particles 25um'] = pmdata.data[9]
-        pmvalues['particles 50um'] = pmdata.data[10]
-        pmvalues['particles 100um'] = pmdata.data[11]
-
-    return pmvalues
+    while True:
+        frame = pm25.poll()
+        if not frame:
+            break
+        if pm_phase == PHASE_WARMUP or pm_phase == PHASE_SLEEP:
+            pm_warmup_frames += 1
+            continue
+        data = frame.data
+        for i in range(SAMPLE.PM_COUNT):
+            pm_sums[i] += data[i]
+        pm_frames += 1
+        count += 1
+
+    return count
+
+def finish_pms25():
+    """
+    Average the frames received during the current interval into the sample
+    record and start a new interval. PM fields are left empty if no frame was
+    received. Returns the number of frames averaged.
+    """
+    global pm_frames
+    frames = pm_frames
+
+    for i in range(SAMPLE.PM_COUNT):
+        if(frames):
+            sample.set(i, pm_sums[i] / frames)
+        else:
+            sample.unset(i)
+        pm_sums[i] = 0
+    pm_frames = 0
+
+    return frames
+
+def check_pms25(frames):
+    """
+    Count the intervals without PM data and reset the PMS5003 after
+    PM_RESET_AFTER of them in a row. Set PM_RESET_AFTER to 0 to never reset.
+    """
+    global pm_failures
+
+    if(frames):
+        pm_failures = 0
+        return
+
+    print("Unable to read PM2.5 Data")
+    metric_pm_missed.inc()
+    if pm25.resetting:
+        return
+
+    pm_failures += 1
+    if PM_RESET_AFTER and pm_failures >= PM_RESET_AFTER:
+        print("Resetting PM Sensor...")
+        pm_failures = 0
+        metric_pm_resets.inc()
+        pm25.start_reset()
+
+def update_pms25():
+    """
+    Advance a PMS5003 reset, if one is in progress, and report how it ended.
+    """
+    if pm25.resetting and not pm25.update():
+        if pm25.reset_error:
+            print(pm25.reset_error)
+        else:
+            print("PM Sensor reset")
+
+def duty_cycle_pms25(clock, now):
+    """
+    Put the PMS5003 to sleep after a measurement and wake it up pm_awake_time
+    seconds before the next one, for an interval that started at clock.
+    The commands are sent again if a reset woke the sensor up.
+    """
+    global pm_phase
+
+    if not pm_duty_cycle:
+        return
+
+    wake_at = clock + INTERVAL - pm_awake_time
+    if now < wake_at:
+        pm_phase = PHASE_SLEEP
+    elif now < wake_at + PM_WARMUP:
+        pm_phase = PHASE_WARMUP
+    else:
+        pm_phase = PHASE_SAMPLE
+
+    if pm25.resetting:
+        return
+    if pm_phase == PHASE_SLEEP:
+        if not pm25.sleeping:
+            pm25.sleep()
+    elif pm25.sleeping:
+        pm25.wake()
 
 def pmdata_aqi():
     """
     Get AQI information based on average values
     """
-    value = USAQI.pm25_aqi(average_values(avgDict)['pm25 env'])
-    value = USAQI.aqi_info(value)
+    if not averaged.has(SAMPLE.PM25_ENV):
+        return {}
+    values = averaged.values
+    pm100 = round(values[SAMPLE.PM100_ENV]) if averaged.has(SAMPLE.PM100_ENV) else None
+    overall, pm25_index, pm100_index = USAQI.pm_aqi(round(values[SAMPLE.PM25_ENV]), pm100)
+
+    value = USAQI.aqi_info(overall)
+    value['aqi pm25'] = pm25_index
+    if pm100_index is not None:
+        value['aqi pm100'] = pm100_index
+
+    # The NowCast needs measurements in 2 of the last 3 hours
+    nowcast_pm25 = nowcast.value()
+    if nowcast_pm25 is not None:
+        value['nowcast pm25'] = nowcast_pm25
+        value['aqi nowcast'] = USAQI.pm25_aqi(nowcast_pm25)
     return value
 
 def read_temp_hum():
     """
-    Read temp and humidity from environment sensor
+    Read temp and humidity from environment sensor into the sample record
     """
-    values = {}
     try:
         if(C_TO_F):
-            values['temperature'] = round(c_to_f(th.temperature), 2)
+            sample.set(SAMPLE.TEMPERATURE, c_to_f(th.temperature))
         else:
-            values['temperature'] = round(th.temperature, 2)
+            sample.set(SAMPLE.TEMPERATURE, th.temperature)
         
-        values['humidity'] = round(th.relative_humidity, 2)
+        sample.set(SAMPLE.HUMIDITY, th.relative_humidity)
     except Exception:
+        sample.unset(SAMPLE.TEMPERATURE)
+        sample.unset(SAMPLE.HUMIDITY)
         print("No temp or humidity sensor")
 
-    return values
+    return sample
 
 def read_analog():
     """
@@ -207,6 +441,7 @@ def blink(led, period, times):
     """
     Blink the LED passed to the function. Period is how long the led
     will be on and Times is how many times it will blink.
+    This blocks, once the tasks are running use request_blink instead.
     """
     for i in range(times):
         led_on(led)
@@ -215,17 +450,29 @@ def blink(led, period, times):
         if(i != times):
             time.sleep(period)
 
+# Blink patterns waiting for the LED task, as (led, period, times)
+blink_requests = []
+
+def request_blink(led, period, times):
+    """
+    Ask the LED task to blink the LED passed to the function without blocking.
+    """
+    blink_requests.append((led, period, times))
+
 def led_status(values):
     """
     Turn onboard LEDs on/off based on sensor data. This can be used to create a status
-    indicator based on sensor reading values.
+    indicator based on sensor reading values. An LED is off while its
+    measurement is missing.
     """
-    if(LED_R_LOW_THRESHOLD < values[LED_R_MEASURE] <= LED_R_HIGH_THRESHOLD):
+    value = values.get(LED_R_MEASURE)
+    if(value is not None and LED_R_LOW_THRESHOLD < value <= LED_R_HIGH_THRESHOLD):
         board_led_r.value = True
     else:
         board_led_r.value = False
 
-    if(LED_G_LOW_THRESHOLD < values[LED_G_MEASURE] <= LED_G_HIGH_THRESHOLD):
+    value = values.get(LED_G_MEASURE)
+    if(value is not None and LED_G_LOW_THRESHOLD < value <= LED_G_HIGH_THRESHOLD):
         board_led_g.value = True
     else:
         board_led_g.value = False
@@ -239,35 +486,21 @@ def merge_dicts(values, dicts):
 
     return dicts
 
-def average_dict(dicts):
+def average_sample(record):
     """
-    Record sensor measurements in a dictionary of lists. Used to smooth sensor readings
+    Record sensor measurements in the smoothing store. Used to smooth sensor readings
     so they don't jump around too much.
     """
-    for d in dicts:
-        # Add sensor measurement to avgDict if it doesn't already exists
-        # Helpful for not having to declare every possible sensor measure
-        if(d not in avgDict):
-            avgDict[d]=[]
-        avgDict[d].append(dicts[d])
-        ln = len(avgDict[d])
-        if(ln > SMOOTH):
-            newList = avgDict[d]
-            # Only keep SMOOTH number of items in the list
-            avgDict[d] = newList[ln-SMOOTH:]
-
-    return avgDict
+    avgStore.add(record)
+
+    return avgStore
     
-def average_values(avgDict):
+def average_values(avgStore):
     """
-    Calculates the average measurement based on values stored in the average dict.
-    Returns the averaged measurements
+    Calculates the average measurement based on values stored in the smoothing store.
+    Returns the averaged record
     """
-    values = {}
-    for v in avgDict:
-        values[v] = round(sum(avgDict[v])/len(avgDict[v]))
-
-    return values
+    return avgStore.average_into(averaged)
 
 def c_to_f(temp):
     """
@@ -283,9 +516,10 @@ def error_message(message1, message2, terminate=1):
     """
     print(message1)
     print(message2)
-    blink(board_led_r, 0.2, 3)
     if(terminate):
+        blink(board_led_r, 0.2, 3)
         sys.exit()
+    request_blink(board_led_r, 0.2, 3)
 
 
 print("Connecting to WiFi...")
@@ -306,6 +540,11 @@ pool = socketpool.SocketPool(wifi.radio)
 # Create HTML server
 server = Server(pool, '/html', debug=True)
 
+# Files under /html are read once here and served from RAM, see dphacks_assets
+asset_buffer = bytearray(512)
+assets = Assets(server.root_path, ASSET_MAX_RAM, asset_buffer)
+print('Static files use', assets.bytes(), 'bytes')
+
 #  prints MAC address to REPL
 print("My MAC addr:", [hex(i) for i in wifi.radio.mac_address])
 
@@ -318,109 +557,422 @@ mqtt_client = MQTT.MQTT(
     port=MQTT_PORT,
     socket_pool=pool,
     is_ssl=MQTT_ISTLS,
-    connect_retries = 2
+    keep_alive=MQTT_KEEP_ALIVE,
+    socket_timeout=MQTT_SOCKET_TIMEOUT,
+    recv_timeout=MQTT_RECV_TIMEOUT,
+    # A single try per attempt, the retries are spaced out by mqtt_backoff
+    # instead of sleeping in the library
+    connect_retries = 1
 )
 
+# Messages wait here until they are published, so nothing is lost while the
+# broker can't be reached. Messages that don't fit spill over to flash if
+# MQTT_SPILL is set.
+mqtt_spill_path = None
+if MQTT_ENABLED and MQTT_SPILL:
+    try:
+        make_parent_dir(MQTT_SPILL_PATH)
+        mqtt_spill_path = MQTT_SPILL_PATH
+    except OSError as e:
+        print("MQTT spill disabled, the drive is not writable:", e)
+outbox = Outbox(MQTT_QUEUE, mqtt_spill_path, MQTT_SPILL)
+mqtt_backoff = Backoff(maximum=MQTT_BACKOFF_MAX)
+# False after a publish or ping failed, until the client reconnected
+mqtt_online = False
+# When the broker last answered, see mqtt_keep_alive()
+mqtt_pinged = 0
+
+# Latest readings for the HTTP routes, as taken by the measurement loop.
+# Readings older than SAMPLE_MAX_AGE seconds are not served.
+latest = SampleCache(SAMPLE_MAX_AGE)
+
+# Smoothed measurements and AQI of the last interval, as published to MQTT
+mqtt_msg = {}
+# Number of measurements since boot. Together with the random BOOT_ID it
+# identifies the current measurement in ETags.
+measurements = 0
+BOOT_ID = int.from_bytes(os.urandom(4), 'big')
+# mqtt_msg serialized to JSON, only done once per measurement
+mqtt_json = None
+mqtt_json_measurement = -1
+
+NOT_MODIFIED_304 = Status(304, "Not Modified")
+
+# With MQTT_DEADBAND set, only the fields that changed enough are published,
+# each on its own topic, with a retained keyframe every MQTT_KEYFRAME intervals
+mqtt_deadband = None
+if MQTT_ENABLED and MQTT_DEADBAND:
+    try:
+        mqtt_deadband = Deadband(MQTT_DEADBAND, MQTT_KEYFRAME)
+    except ValueError as e:
+        error_message("MQTT_DEADBAND in settings.toml is not valid", e)
+
+# With MQTT_BATCH above 1 or the binary encoding, measurements are collected
+# and published MQTT_BATCH at a time, see dphacks_payload
+mqtt_batch = None
+if MQTT_ENABLED and mqtt_deadband is None and (MQTT_BATCH > 1 or MQTT_ENCODING != PAYLOAD.JSON):
+    mqtt_batch = PAYLOAD.Batch(MQTT_BATCH, MQTT_ENCODING)
+    batch_row = array.array('f', [0.0] * PAYLOAD.NUM_COLUMNS)
+
+# Open /events streams as (request, response) pairs. New streams wait in
+# sse_new until their headers are sent, then they get the last measurement.
+sse_streams = []
+sse_new = []
+# Clients don't send anything on an event stream, this only detects hang ups
+sse_probe = bytearray(1)
+
+# Counters, gauges and latency histograms served on /metrics. Counts kept by
+# the PMS5003 driver and the MQTT queue are collected when /metrics is read.
+metrics = Metrics()
+metrics.counter('measurements_total', "Measurements taken", read=lambda: measurements)
+metrics.counter('pm_reads_total', "PMS5003 data frames read", read=lambda: pm25.reads)
+metrics.counter('pm_retries_total', "PMS5003 reads requested again after no answer",
+                read=lambda: pm25.retries)
+metrics.counter('pm_checksum_errors_total', "PMS5003 frames with a checksum mismatch",
+                read=lambda: pm25.checksum_errors + pm25.assembler.checksum_errors)
+metrics.counter('pm_length_errors_total', "PMS5003 frames with an invalid length",
+                read=lambda: pm25.length_errors + pm25.assembler.length_errors)
+metric_pm_timeouts = metrics.counter('pm_timeouts_total', "PMS5003 read requests that timed out")
+metric_pm_missed = metrics.counter('pm_missed_total', "Intervals without PMS5003 data")
+metric_pm_resets = metrics.counter('pm_resets_total', "PMS5003 resets started")
+metrics.counter('pm_warmup_frames_total', "PMS5003 frames dropped while warming up",
+                read=lambda: pm_warmup_frames)
+metrics.gauge('pm_sleeping', "1 while the PMS5003 is asleep", read=lambda: int(pm25.sleeping))
+metric_mqtt_published = metrics.counter('mqtt_published_total', "MQTT messages published")
+metric_mqtt_failures = metrics.counter('mqtt_failures_total', "MQTT publishes and reconnects that failed")
+metrics.counter('mqtt_dropped_total', "MQTT messages dropped from the full queue",
+                read=lambda: outbox.dropped)
+metrics.gauge('mqtt_queued', "MQTT messages waiting to be published", read=lambda: len(outbox))
+metric_task_errors = metrics.counter('task_errors_total', "Errors caught in the tasks, by task", 'task')
+metric_http_requests = metrics.counter('http_requests_total', "HTTP requests by route", 'route')
+metrics.gauge('sse_streams', "Open /events streams", read=lambda: len(sse_streams))
+metrics.gauge('mem_free_bytes', "Free heap memory", read=gc.mem_free)
+metrics.gauge('mem_alloc_bytes', "Allocated heap memory", read=gc.mem_alloc)
+metrics.gauge('uptime_seconds', "Seconds since the board started", read=lambda: int(time.monotonic()))
+metric_sensor_read = metrics.histogram('sensor_read_seconds', "Time to read the I2C sensors")
+metric_pm_poll = metrics.histogram('pm_poll_seconds', "Time to collect the PMS5003 frames that arrived")
+metric_http_poll = metrics.histogram('http_poll_seconds', "Time of server.poll(), serving the request included")
+metric_mqtt_publish = metrics.histogram('mqtt_publish_seconds', "Time to publish a MQTT message")
+metric_loop = metrics.histogram('loop_seconds', "Time of a sample loop iteration, measuring included")
+
+def current_json():
+    """
+    Returns the last measurement as JSON. It is only serialized the first
+    time it is needed.
+    """
+    global mqtt_json, mqtt_json_measurement
+    if mqtt_json_measurement != measurements:
+        mqtt_json = json.dumps(mqtt_msg)
+        mqtt_json_measurement = measurements
+
+    return mqtt_json
+
+def current_etag():
+    """
+    Returns the ETag of the last measurement
+    """
+    return '"{:08x}-{:x}"'.format(BOOT_ID, measurements)
+
+def sse_connected(request):
+    """
+    Returns False once the client of an /events stream hung up.
+    Writing to such a socket doesn't always fail, so peek at it instead.
+    """
+    conn = request.connection
+    conn.setblocking(False)
+    try:
+        # A closed connection reads as end of stream
+        return conn.recv_into(sse_probe) != 0
+    except OSError as e:
+        return e.errno == EAGAIN
+    finally:
+        conn.settimeout(server.socket_timeout)
+
+def sse_send(entry):
+    """
+    Send the last measurement to an /events stream.
+    Streams that are gone are closed and dropped.
+    """
+    request, stream = entry
+    try:
+        if sse_connected(request):
+            stream.send_event(current_json(), id=measurements)
+            return
+    except OSError:
+        pass
+
+    sse_streams.remove(entry)
+    try:
+        stream.close()
+    except OSError:
+        pass
+
+def sse_publish():
+    """
+    Push the last measurement to every open /events stream.
+    """
+    # Iterate over a copy, sse_send removes closed streams from the list
+    for entry in tuple(sse_streams):
+        sse_send(entry)
+
+def sse_start():
+    """
+    Send the last measurement to the streams opened since the last call.
+    """
+    while sse_new:
+        entry = sse_new.pop()
+        if mqtt_msg and entry in sse_streams:
+            sse_send(entry)
+
+def asset_response(request, asset):
+    """
+    Serve a static file with its ETag, answering 304 Not Modified if the
+    client already has it. The gzip copy is only sent to clients that accept it.
+    """
+    if asset.gzip and 'gzip' not in request.headers.get('Accept-Encoding', ''):
+        return FileResponse(request, asset.name)
+
+    headers = {
+        'ETag': asset.etag,
+        'Cache-Control': 'public, max-age={}'.format(ASSET_MAX_AGE),
+        'Vary': 'Accept-Encoding'
+    }
+    if asset.etag in request.headers.get('If-None-Match', ''):
+        return Response(request, status=NOT_MODIFIED_304, headers=headers)
+
+    if asset.gzip:
+        headers['Content-Encoding'] = 'gzip'
+    content_type = MIMETypes.get_for_filename(asset.name)
+    if asset.body is None:
+        return ChunkedResponse(request, lambda: asset.chunks(asset_buffer),
+                               headers=headers, content_type=content_type)
+    return Response(request, asset.body, headers=headers, content_type=content_type)
+
+def static_file(request: Request):
+    """
+    Serve one of the files under /html.
+    """
+    return asset_response(request, assets.get(request.path))
+
+def led_state(request, name, value):
+    """
+    Small JSON answer for the LED routes
+    """
+    return JSONResponse(request, {name: value})
+
+def counted(path, handler):
+    """
+    Wrap a route handler so its requests are counted on /metrics
+    """
+    def count(request, *args, **kwargs):
+        metric_http_requests.inc(path)
+        return handler(request, *args, **kwargs)
+    return count
+
+def route(path, methods=GET):
+    """
+    Same as server.route, but the requests of the route are counted on /metrics
+    """
+    def register(handler):
+        server.route(path, methods)(counted(path, handler))
+        return handler
+    return register
+
+def log_sample():
+    """
+    Add the sample record to the log on flash, if it is enabled
+    """
+    if sample_log is None:
+        return
+    try:
+        sample_log.append(sample, int(time.time()))
+    except OSError as e:
+        print("Could not write the sample log:", e)
+
 ### HTML SERVER ROUTES ###
 # There are all the endpoints/URLs available
-@server.route("/")
+@route("/")
 def base(request: Request):
     """
     Serve the default index.html file.
     """
-    return FileResponse(request, "index.html")
+    return asset_response(request, assets.get("/index.html"))
 
-@server.route("/getdata")
+@route("/getdata")
 def get_sensor_data(request: Request):
     """
-    Read sendor data and return JSON.
+    Serve the smoothed sensor data from the last measurement as JSON,
+    with the duty cycle phase of the PM sensor.
     """
-    data = read_all()
-
-    # averrage to smooth out values
-    avgDict = average_dict(data)
-    data = average_values(avgDict)
+    data = averaged.to_dict()
+    data['pm phase'] = pm_phase
 
     return JSONResponse(request, data)
 
-@server.route("/pmdata")
+@route("/api/current")
+def api_current(request: Request):
+    """
+    Serve the smoothed sensor data and AQI of the last measurement as JSON.
+    Answers 304 Not Modified if the client already has this measurement.
+    """
+    etag = current_etag()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(request, status=NOT_MODIFIED_304, headers=headers)
+
+    return Response(request, current_json(), headers=headers, content_type="application/json")
+
+@route("/events")
+def events(request: Request):
+    """
+    Stream every new measurement as a Server-Sent Event. The number of open
+    streams is limited to SSE_MAX_STREAMS, clients over the limit get 503.
+    """
+    if len(sse_streams) >= SSE_MAX_STREAMS:
+        return Response(request, "Too many event streams",
+                        status=SERVICE_UNAVAILABLE_503,
+                        headers={'Retry-After': str(INTERVAL)})
+
+    stream = SSEResponse(request)
+    sse_streams.append((request, stream))
+    sse_new.append((request, stream))
+    return stream
+
+@route("/history")
+def history_csv(request: Request):
+    """
+    Serve the measurement history as CSV. ?tier= is raw, minute (default)
+    or hour and ?since= leaves out entries older than that time in seconds.
+    """
+    tier = history.tier(request.query_params.get('tier', 'minute'))
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        since = None
+
+    if tier is None or since is None:
+        return Response(request, "Use ?tier=raw|minute|hour&since=<seconds>",
+                        status=BAD_REQUEST_400)
+
+    return ChunkedResponse(request, lambda: history.csv(tier, since, history_buffer),
+                           content_type="text/csv")
+
+@route("/log")
+def log_blocks(request: Request):
+    """
+    Stream the sample log in its binary format, starting with the block that
+    has the records from ?since= (seconds). tools/decode_log.py reads it.
+    """
+    if sample_log is None:
+        return Response(request, "The sample log is disabled", status=NOT_FOUND_404)
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        return Response(request, "Use ?since=<seconds>", status=BAD_REQUEST_400)
+
+    return ChunkedResponse(request, lambda: sample_log.blocks(since),
+                           content_type="application/octet-stream")
+
+@route("/metrics")
+def metrics_text(request: Request):
+    """
+    Serve the counters, gauges and latency histograms in the Prometheus text format.
+    """
+    return ChunkedResponse(request, metrics.lines, content_type="text/plain; version=0.0.4")
+
+def latest_response(request, first, last, ndigits=None):
+    """
+    Serve the fields between the first and last column of the latest readings
+    as JSON, with their age in seconds. Answers 503 without recent readings.
+    """
+    record, age = latest.get()
+    if record is None:
+        return Response(request, "No recent measurement",
+                        status=SERVICE_UNAVAILABLE_503,
+                        headers={'Retry-After': str(INTERVAL)})
+
+    return JSONResponse(request, record.to_dict(first, last, ndigits),
+                        headers={'Age': str(int(age))})
+
+@route("/pmdata")
 def pmdata_client(request: Request):
     """
     Serve PMS 5003 data as JSON.
     """
-    data = read_pms25()
-    return JSONResponse(request, data)
+    return latest_response(request, 0, SAMPLE.PM_COUNT)
 
-@server.route("/aqi")
+@route("/aqi")
 def pmdata_client(request: Request):
     """
     Serve US AQI info as JSON.
     """
-    data = USAQI.pm25_aqi(average_values(avgDict)['pm25 env'])
-    data = USAQI.aqi_info(data)
+    data = pmdata_aqi()
     return JSONResponse(request, data)
 
-@server.route("/th")
+@route("/th")
 def pmdata_client(request: Request):
     """
     Serve Temp and Humidity data as JSON.
     """
-    data = read_temp_hum()
-    return JSONResponse(request, data)
+    return latest_response(request, SAMPLE.TEMPERATURE, SAMPLE.HUMIDITY + 1, 2)
     
-@server.route("/ledon")
+@route("/ledon")
 def pico_led_on(request: Request):
     """
     Turn on the Pico W LED.
     """
     led.value = True
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "led", True)
 
-@server.route("/ledoff")
+@route("/ledoff")
 def pico_led_on(request: Request):
     """
     Turn off the Pico W LED.
     """
     led.value = False
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "led", False)
 
-@server.route("/redledon")
+@route("/redledon")
 def board_led_on(request: Request):
     """
     Turn on the red LED.
     """
     led_on(board_led_r)
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "red led", True)
 
-@server.route("/redledoff")
+@route("/redledoff")
 def board_led_on(request: Request):
     """
     Turn off the red LED.
     """
     led_off(board_led_r)
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "red led", False)
 
-@server.route("/greenledon")
+@route("/greenledon")
 def board_led_on(request: Request):
     """
     Turn on the green LED.
     """
     led_on(board_led_g)
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "green led", True)
 
-@server.route("/greenledoff")
+@route("/greenledoff")
 def board_led_on(request: Request):
     """
     Turn off the green LED.
     """
     led_off(board_led_g)
 
-    return FileResponse(request, "index.html")
+    return led_state(request, "green led", False)
+
+# Every static file gets a route, so it is served from RAM
+server.add_routes([Route(path, GET, counted(path, static_file)) for path in assets.files])
 
 ### MQTT METHODS ###
 ## Leaving all methods here even though not all are being used
@@ -469,13 +1021,20 @@ def message(client, topic, message):
 
 def mqtt_try_reconnect():
     """
-    Try to reconnect to MQTT broker service.
+    Try to reconnect to MQTT broker service. If it fails the next
+    attempt waits for the backoff delay.
     """
+    global mqtt_online, mqtt_pinged
     try:
         mqtt_client.reconnect()
-    except MQTT.MMQTTException as e:
+        mqtt_online = True
+        mqtt_pinged = time.monotonic()
+        mqtt_backoff.succeeded()
+    except (MQTT.MMQTTException, OSError) as e:
         # Don't quit if can't reconnect, let it try again.
-        error_message("Not able to reconnect to MQTT broker", e, 0)
+        metric_mqtt_failures.inc()
+        delay = mqtt_backoff.failed()
+        error_message("Not able to reconnect to MQTT broker, next try in {:.0f}s".format(delay), e, 0)
 
 # Connect callback handlers for mqtt_client
 mqtt_client.on_connect = connect
@@ -493,57 +1052,284 @@ if MQTT_USERNAME and MQTT_PASSWORD:
 if MQTT_ENABLED:
     try:
         mqtt_client.connect()
-    except MQTT.MMQTTException as e:
+        mqtt_online = True
+        mqtt_pinged = time.monotonic()
+    except (MQTT.MMQTTException, OSError) as e:
+        # Measurements are queued and the connection retried in the background
+        mqtt_backoff.failed()
         error_message(e, ("MQTT is enabled in settings.toml but it was not possible to connect \n"
               "to a MQTT broker. Check the MQTT parameters in settings.toml to make \n"
-              "sure they are correct."))
+              "sure they are correct."), 0)
 
 # Start the HTML server.
 server.start(str(wifi.radio.ipv4_address))
 
-# Get clock reference
-clock = time.monotonic()
-values = {}
+def measure():
+    """
+    Take the measurements for the last interval, smooth them and
+    prepare the MQTT message.
+    """
+    global mqtt_msg, measurements
+
+    check_pms25(finish_pms25())
 
-while True:
+    latest.put(read_all())
+    if sample.has(SAMPLE.PM25_ENV):
+        nowcast.add(sample.values[SAMPLE.PM25_ENV])
+    history.add(sample, int(time.time()))
+    log_sample()
     
-    # Take the measurements after every interval
-    if (clock + INTERVAL) < time.monotonic():
+    # averrage to smooth out values
+    average_sample(sample)
+    average_values(avgStore)
 
-        mqtt_msg = {}
+    # Only build the dictionary for publishing once all the numbers are in
+    mqtt_msg = averaged.to_dict()
 
-        mqtt_msg = read_all()
-        
-        # averrage to smooth out values
-        avgDict = average_dict(mqtt_msg)
+    aqi = pmdata_aqi()
 
-        mqtt_msg = average_values(avgDict)
+    mqtt_msg = merge_dicts(aqi, mqtt_msg)
+    measurements += 1
 
-        aqi = pmdata_aqi()
+    if MQTT_ENABLED:
+        mqtt_queue()
 
-        mqtt_msg = merge_dicts(aqi, mqtt_msg)
+    led_status(mqtt_msg)
+    sse_publish()
 
-        led_status(mqtt_msg)
+def batch_add():
+    """
+    Add the last measurement, with its AQIs, to the MQTT batch
+    """
+    for i in range(SAMPLE.NUM_FIELDS):
+        batch_row[i] = averaged.values[i]
+    valid = averaged.valid
+    for column in range(SAMPLE.NUM_FIELDS, PAYLOAD.NUM_COLUMNS):
+        value = mqtt_msg.get(PAYLOAD.COLUMNS[column])
+        if value is not None:
+            batch_row[column] = value
+            valid |= 1 << column
 
-        if MQTT_ENABLED:
-            if not mqtt_client.is_connected():
-                mqtt_try_reconnect()
-                continue
+    mqtt_batch.add(int(time.time()), batch_row, valid)
 
-            else:     
-                if (mqtt_msg and wifi.radio.connected):
-                    try:
-                        mqtt_client.publish(MQTT_TOPIC, json.dumps(mqtt_msg))
-                    except MQTT.MMQTTException as e:
-                        print(e)
-                    except:
-                        print(("WiFi disconnected and MQTT socket is broken... \n"
-                              "Trying to reconnect"))
-                        mqtt_try_reconnect()
-                else:
-                    print("No successful readings or wifi is disconnected")
+def mqtt_queue():
+    """
+    Queue the last measurement for publishing. When batching, the batch is
+    queued once it is full.
+    """
+    if mqtt_deadband is not None:
+        mqtt_queue_changes()
+        return
 
-        clock = time.monotonic()
-    
-    # Process html requests between reading sensor data
-    pool_result = server.poll() # type: ignore
\ No newline at end of file
+    if mqtt_batch is None:
+        outbox.put(current_json())
+        return
+
+    batch_add()
+    if mqtt_batch.full():
+        outbox.put(mqtt_batch.encode())
+        mqtt_batch.clear()
+
+def mqtt_queue_changes():
+    """
+    Queue the fields that moved past their deadband, each to MQTT_TOPIC/<field>
+    with spaces replaced by _. Keyframes go to MQTT_TOPIC as usual, retained.
+    """
+    if mqtt_deadband.next():
+        mqtt_deadband.sent(mqtt_msg)
+        outbox.put(current_json(), retain=True)
+        return
+
+    for name, value in mqtt_deadband.changes(mqtt_msg):
+        outbox.put(json.dumps(value), MQTT_TOPIC + '/' + name.replace(' ', '_'))
+
+def mqtt_publish():
+    """
+    Publish the oldest queued message to the MQTT broker. While disconnected,
+    reconnect once the backoff delay is over. Returns True if a message was sent.
+    """
+    global mqtt_online
+
+    if not len(outbox):
+        return False
+
+    if not (mqtt_online and mqtt_client.is_connected()):
+        if wifi.radio.connected and mqtt_backoff.ready():
+            mqtt_try_reconnect()
+        return False
+
+    topic, message, retain = outbox.peek()
+    start = metric_mqtt_publish.start()
+    try:
+        mqtt_client.publish(topic or MQTT_TOPIC, message, retain)
+    except Exception as e:
+        metric_mqtt_failures.inc()
+        # Keep the message, it is sent again after reconnecting
+        print(("WiFi disconnected and MQTT socket is broken... \n"
+              "Trying to reconnect"), e)
+        mqtt_online = False
+        mqtt_backoff.failed()
+        return False
+
+    metric_mqtt_publish.done(start)
+    metric_mqtt_published.inc()
+    outbox.pop()
+    return True
+
+def mqtt_keep_alive():
+    """
+    Ping the broker every half of MQTT_KEEP_ALIVE, so it doesn't drop the
+    session between publishes. A session that is already gone is found
+    here rather than by losing the next message.
+    """
+    global mqtt_online, mqtt_pinged
+
+    if not (mqtt_online and mqtt_client.is_connected()):
+        return
+    if time.monotonic() - mqtt_pinged < MQTT_KEEP_ALIVE / 2:
+        return
+
+    # ping() waits up to keep_alive seconds for the answer, the value sent to
+    # the broker when connecting. Lowered meanwhile so it can't stall the
+    # other tasks for longer than MQTT_RECV_TIMEOUT.
+    mqtt_client.keep_alive = MQTT_RECV_TIMEOUT
+    try:
+        mqtt_client.ping()
+        mqtt_pinged = time.monotonic()
+    except Exception as e:
+        metric_mqtt_failures.inc()
+        print("MQTT broker didn't answer the ping... \nTrying to reconnect", e)
+        mqtt_online = False
+        mqtt_backoff.failed()
+    finally:
+        mqtt_client.keep_alive = MQTT_KEEP_ALIVE
+
+### TASKS ###
+def task_error(task, e):
+    """
+    Report an error caught in a task. The task carries on with its next
+    iteration, as one bad measurement or request shouldn't stop the board.
+    """
+    print("Error in the", task, "task:", repr(e))
+    metric_task_errors.inc(task)
+
+async def sample_task():
+    """
+    Collect PM data as it arrives and take the measurements after every interval.
+    """
+    # Get clock reference
+    clock = time.monotonic()
+    # Time the pending PM read was requested, 0 when there is none
+    pm_requested = 0
+
+    while True:
+        try:
+            loop_start = metric_loop.start()
+            now = time.monotonic()
+
+            start = metric_pm_poll.start()
+            update_pms25()
+            duty_cycle_pms25(clock, now)
+            frames = poll_pms25()
+            metric_pm_poll.done(start)
+
+            # Request a PM reading after every interval. This does nothing in active
+            # mode where the sensor streams frames on its own.
+            measure_now = False
+            if not pm_requested and (clock + INTERVAL) < now:
+                if pm25.resetting:
+                    # No reading can be requested while the sensor resets, so
+                    # don't wait for one and measure the other sensors
+                    measure_now = True
+                else:
+                    pm25.request_read()
+                    pm_requested = now
+
+            # Take the measurements right away in active mode. In passive mode wait
+            # until the requested frame arrived or the request timed out.
+            if pm_requested and (PM_MODE == 'active' or frames
+                                 or (pm_requested + PM_READ_TIMEOUT) < now):
+                if PM_MODE != 'active' and not frames:
+                    metric_pm_timeouts.inc()
+                measure_now = True
+
+            if measure_now:
+                pm_requested = 0
+                # Start the next interval first, so a failed measurement isn't
+                # retried on every iteration
+                clock = time.monotonic()
+                measure()
+
+            metric_loop.done(loop_start)
+        except Exception as e:
+            task_error('sample', e)
+        await asyncio.sleep(PM_POLL_PERIOD)
+
+async def http_task():
+    """
+    Process html requests. Keep going without sleeping while requests are coming in.
+    """
+    while True:
+        result = NO_REQUEST
+        try:
+            start = metric_http_poll.start()
+            result = server.poll()
+            metric_http_poll.done(start)
+            if result != NO_REQUEST:
+                sse_start()
+        except Exception as e:
+            task_error('http', e)
+        if result == NO_REQUEST:
+            await asyncio.sleep(HTTP_POLL_PERIOD)
+        else:
+            await asyncio.sleep(0)
+
+async def mqtt_task():
+    """
+    Publish the queued measurements to the MQTT broker, at most
+    MQTT_DRAIN_RATE messages per second, and keep the connection alive
+    in between.
+    """
+    while True:
+        sent = False
+        try:
+            sent = mqtt_publish()
+            if not sent:
+                mqtt_keep_alive()
+        except Exception as e:
+            task_error('mqtt', e)
+        if sent:
+            await asyncio.sleep(1 / MQTT_DRAIN_RATE)
+        else:
+            await asyncio.sleep(MQTT_POLL_PERIOD)
+
+async def led_task():
+    """
+    Blink the LEDs requested with request_blink.
+    """
+    while True:
+        try:
+            while blink_requests:
+                led, period, times = blink_requests.pop(0)
+                for i in range(times):
+                    led_on(led)
+                    await asyncio.sleep(period)
+                    led_off(led)
+                    await asyncio.sleep(period)
+        except Exception as e:
+            task_error('led', e)
+
+        await asyncio.sleep(LED_PERIOD)
+
+async def main():
+    tasks = [
+        asyncio.create_task(sample_task()),
+        asyncio.create_task(http_task()),
+        asyncio.create_task(led_task()),
+    ]
+    if MQTT_ENABLED:
+        tasks.append(asyncio.create_task(mqtt_task()))
+
+    await asyncio.gather(*tasks)
+
+asyncio.run(main())
@@ -0,0 +1,130 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Static files of the web server, read from flash once at boot.
+# A file with an up to date .gz copy next to it (see tools/build_assets.py) is
+# served from that copy with Content-Encoding: gzip. Every file gets an ETag
+# from the CRC32 of its content so browsers can revalidate it with a 304.
+
+
+import os
+from binascii import crc32
+
+GZIP_SUFFIX = '.gz'
+# Bit of the os.stat() mode that marks a directory
+_DIRECTORY = 0x4000
+
+
+def _mtime(path):
+    """
+    Returns the modification time of a file, or None if it doesn't exist
+    """
+    try:
+        return os.stat(path)[8]
+    except OSError:
+        return None
+
+
+class Asset:
+    """
+    A static file. Files up to max_ram bytes are kept in RAM in body, bigger
+    ones stay on flash (body is None) and are read in chunks when served.
+    """
+
+    def __init__(self, name, path, gzip, max_ram, buffer):
+        self.name = name
+        self.path = path
+        self.gzip = gzip
+        self.body = None
+        self.size = os.stat(path)[6]
+
+        if self.size <= max_ram:
+            with open(path, 'rb') as f:
+                self.body = f.read()
+            crc = crc32(self.body)
+        else:
+            crc = 0
+            for chunk in self._read(buffer):
+                crc = crc32(chunk, crc)
+
+        # The gzip copy is a different representation, so it gets its own tag
+        self.etag = '"{:08x}{}"'.format(crc & 0xffffffff, '-gz' if gzip else '')
+
+    def _read(self, buffer):
+        view = memoryview(buffer)
+        with open(self.path, 'rb') as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                yield view[:size]
+
+    def chunks(self, buffer):
+        """
+        Yields the content, read into buffer when the file is not in RAM
+        """
+        if self.body is not None:
+            yield self.body
+        else:
+            yield from self._read(buffer)
+
+
+class Assets:
+    """
+    Every file in the root directory, by URL path ("/index.html")
+    """
+
+    def __init__(self, root, max_ram, buffer):
+        self.root = root
+        self.files = {}
+
+        for name in sorted(os.listdir(root)):
+            source = root + '/' + name
+            if name.endswith(GZIP_SUFFIX) or os.stat(source)[0] & _DIRECTORY:
+                continue
+
+            # A .gz copy older than its source was not rebuilt after an edit
+            path = source + GZIP_SUFFIX
+            gzip_mtime = _mtime(path)
+            gzip = gzip_mtime is not None and gzip_mtime >= os.stat(source)[8]
+            if gzip_mtime is not None and not gzip:
+                print("Ignoring", path + ", it is older than", name)
+            if not gzip:
+                path = source
+
+            self.files['/' + name] = Asset(name, path, gzip, max_ram, buffer)
+
+    def get(self, path):
+        """
+        Returns the Asset for a URL path, or None
+        """
+        return self.files.get(path)
+
+    def bytes(self):
+        """
+        RAM used by the file contents
+        """
+        return sum(len(a.body) for a in self.files.values() if a.body is not None)
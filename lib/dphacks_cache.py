@@ -0,0 +1,74 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Cache for the latest sensor readings. HTTP routes are served from the readings
+# taken by the measurement loop instead of talking to the sensors themselves.
+
+
+import time
+
+from dphacks_sample import Sample
+
+
+class SampleCache:
+    """
+    Holds a copy of the latest sample record taken by the measurement loop,
+    the only producer. Readings older than max_age seconds are not served,
+    the measurement loop has stopped taking them.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.value = Sample()
+        self.updated = None
+        self.sequence = 0
+
+    def put(self, sample, now=None):
+        """
+        Store a copy of a sample record. Every record gets the next sequence number.
+        """
+        self.value.copy_from(sample)
+        self.updated = time.monotonic() if now is None else now
+        self.sequence += 1
+
+    def age(self, now=None):
+        """
+        Returns the age of the cached record in seconds, or None if there is none
+        """
+        if self.updated is None:
+            return None
+        return (time.monotonic() if now is None else now) - self.updated
+
+    def get(self, now=None):
+        """
+        Returns the cached record and its age in seconds, or (None, None) if
+        there is none or it is older than max_age
+        """
+        age = self.age(now)
+        if age is None or age > self.max_age:
+            return None, None
+        return self.value, age
@@ -0,0 +1,104 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Change-only publishing. A field is only sent again once it moved more than
+# its deadband away from the value that was sent last. Every `keyframe`
+# intervals all the fields are sent, so subscribers that joined late or
+# missed messages catch up.
+#
+# Deadbands are set with a string like "temperature:0.5, humidity:1, pm25 env:1:10",
+# a field name, an absolute deadband and optionally a relative one in percent
+# of the last sent value. The larger of the two applies. Fields that aren't
+# listed are sent whenever they change.
+
+
+class Deadband:
+    """
+    Tracks the last sent value of every field of the published messages
+    """
+
+    def __init__(self, spec, keyframe=0):
+        self.keyframe = keyframe
+        self._bands = {}
+        self._sent = {}
+        # Intervals since the last keyframe, None before the first one
+        self._intervals = None
+
+        for entry in spec.split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            parts = entry.split(':')
+            if not 2 <= len(parts) <= 3:
+                raise ValueError("Deadband must be name:absolute[:percent], not " + entry)
+            absolute = float(parts[1])
+            relative = float(parts[2]) / 100 if len(parts) == 3 else 0.0
+            self._bands[parts[0].strip()] = (absolute, relative)
+
+    def next(self):
+        """
+        Count an interval. Returns True when a keyframe is due.
+        """
+        if self._intervals is None or (self.keyframe and self._intervals + 1 >= self.keyframe):
+            self._intervals = 0
+            return True
+        self._intervals += 1
+        return False
+
+    def sent(self, message):
+        """
+        Record every field of a message as sent, after a keyframe
+        """
+        self._sent.clear()
+        for name, value in message.items():
+            self._sent[name] = value
+
+    def moved(self, name, value):
+        """
+        Returns True if a field moved past its deadband since it was last sent
+        """
+        if name not in self._sent:
+            return True
+        last = self._sent[name]
+        if not isinstance(value, (int, float)) or not isinstance(last, (int, float)):
+            return value != last
+
+        absolute, relative = self._bands.get(name, (0.0, 0.0))
+        band = max(absolute, relative * abs(last))
+        if band == 0:
+            return value != last
+        return abs(value - last) > band
+
+    def changes(self, message):
+        """
+        Generate the (name, value) fields of a message that moved past their
+        deadband and record them as sent
+        """
+        for name, value in message.items():
+            if self.moved(name, value):
+                self._sent[name] = value
+                yield name, value
@@ -0,0 +1,331 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Measurement history kept in RAM, so a collector that was offline can catch up.
+# There are three tiers: the raw samples of the last minutes, 1 minute rollups
+# for some hours and 1 hour rollups for some days. Every tier is a ring of
+# preallocated arrays sized at boot, so the history never grows. Samples are
+# folded into the current minute as they are added, and every finished minute
+# is folded into the current hour.
+
+
+import array
+
+RAW = 'raw'
+MINUTE = 'minute'
+HOUR = 'hour'
+
+
+class Raw:
+    """
+    Ring of the last `size` samples of the history fields
+    """
+
+    def __init__(self, size, fields):
+        self.size = size
+        self.fields = fields
+        self.times = array.array('L', [0] * size)
+        self.values = array.array('f', [0.0] * (size * fields))
+        self.valid = array.array('L', [0] * size)
+        # Number of entries in the ring and position of the next one
+        self.length = 0
+        self.index = 0
+
+    def add(self, now, values, valid):
+        """
+        Store one sample. values holds the history fields in order and
+        bit i of valid is set when values[i] was measured.
+        """
+        i = self.index
+        self.times[i] = now
+        self.valid[i] = valid
+        base = i * self.fields
+        for field in range(self.fields):
+            self.values[base + field] = values[field]
+
+        self.index = (i + 1) % self.size
+        if self.length < self.size:
+            self.length += 1
+
+    def entries(self):
+        """
+        Iterate over the ring positions from the oldest entry to the newest
+        """
+        start = (self.index - self.length) % self.size
+        for n in range(self.length):
+            yield (start + n) % self.size
+
+    def bytes(self):
+        """
+        Returns the memory used by the arrays
+        """
+        return self.size * (8 + 4 * self.fields)
+
+
+class Rollup:
+    """
+    Ring of the min, mean and max of every history field over periods of
+    `period` seconds. The period in progress is accumulated separately and
+    stored in the ring once the next one starts.
+    """
+
+    def __init__(self, period, size, fields):
+        self.period = period
+        self.size = size
+        self.fields = fields
+        self.times = array.array('L', [0] * size)
+        self.mins = array.array('f', [0.0] * (size * fields))
+        self.means = array.array('f', [0.0] * (size * fields))
+        self.maxs = array.array('f', [0.0] * (size * fields))
+        # Number of samples behind every value, 0 when the field had none
+        self.counts = array.array('H', [0] * (size * fields))
+        self.length = 0
+        self.index = 0
+
+        # Period in progress
+        self._start = None
+        self._sums = array.array('f', [0.0] * fields)
+        self._counts = array.array('H', [0] * fields)
+        self._mins = array.array('f', [0.0] * fields)
+        self._maxs = array.array('f', [0.0] * fields)
+
+        # Coarser rollup that finished periods are folded into
+        self.next = None
+
+    def _roll(self, now):
+        """
+        Finish the period in progress if `now` is past it
+        """
+        start = now - now % self.period
+        if self._start is None:
+            self._start = start
+        elif start != self._start:
+            self._finish()
+            self._start = start
+
+    def _finish(self):
+        """
+        Store the period in progress in the ring and fold it into the next rollup
+        """
+        i = self.index
+        base = i * self.fields
+        self.times[i] = self._start
+        for field in range(self.fields):
+            count = self._counts[field]
+            self.counts[base + field] = count
+            if count:
+                self.mins[base + field] = self._mins[field]
+                self.means[base + field] = self._sums[field] / count
+                self.maxs[base + field] = self._maxs[field]
+
+        self.index = (i + 1) % self.size
+        if self.length < self.size:
+            self.length += 1
+
+        if self.next is not None:
+            self.next.fold(self._start, self._counts, self._sums, self._mins, self._maxs)
+
+        for field in range(self.fields):
+            self._sums[field] = 0.0
+            self._counts[field] = 0
+
+    def _accumulate(self, field, count, total, low, high):
+        """
+        Add `count` samples adding up to `total` to a field of the period in progress
+        """
+        if not count:
+            return
+        if self._counts[field]:
+            if low < self._mins[field]:
+                self._mins[field] = low
+            if high > self._maxs[field]:
+                self._maxs[field] = high
+        else:
+            self._mins[field] = low
+            self._maxs[field] = high
+        self._sums[field] += total
+        # Saturate instead of wrapping around, only the mean depends on it
+        self._counts[field] = min(self._counts[field] + count, 0xFFFF)
+
+    def add(self, now, values, valid):
+        """
+        Add a raw sample to the period in progress
+        """
+        self._roll(now)
+        for field in range(self.fields):
+            if valid & (1 << field):
+                value = values[field]
+                self._accumulate(field, 1, value, value, value)
+
+    def fold(self, start, counts, sums, mins, maxs):
+        """
+        Add a finished period of a finer rollup to the period in progress
+        """
+        self._roll(start)
+        for field in range(self.fields):
+            self._accumulate(field, counts[field], sums[field], mins[field], maxs[field])
+
+    def entries(self):
+        """
+        Iterate over the ring positions from the oldest entry to the newest
+        """
+        start = (self.index - self.length) % self.size
+        for n in range(self.length):
+            yield (start + n) % self.size
+
+    def bytes(self):
+        """
+        Returns the memory used by the arrays
+        """
+        return self.size * (4 + 14 * self.fields) + 14 * self.fields
+
+
+class History:
+    """
+    Tiered history of some fields of the sample records.
+    `fields` is a list of (name, sample field index) pairs.
+    """
+
+    def __init__(self, fields, raw_size, minute_size, hour_size):
+        self.names = [name for name, index in fields]
+        self._indexes = [index for name, index in fields]
+        count = len(fields)
+        if count > 32:
+            raise ValueError("History can keep at most 32 fields")
+
+        self.raw = Raw(raw_size, count)
+        self.minute = Rollup(60, minute_size, count)
+        self.hour = Rollup(3600, hour_size, count)
+        self.minute.next = self.hour
+
+        self._values = array.array('f', [0.0] * count)
+
+    def tier(self, name):
+        """
+        Returns the tier called RAW, MINUTE or HOUR, or None
+        """
+        if name == RAW:
+            return self.raw
+        if name == MINUTE:
+            return self.minute
+        if name == HOUR:
+            return self.hour
+        return None
+
+    def add(self, sample, now):
+        """
+        Add the history fields of a sample record taken at `now` (whole seconds)
+        """
+        valid = 0
+        for field, index in enumerate(self._indexes):
+            if sample.has(index):
+                self._values[field] = sample.values[index]
+                valid |= 1 << field
+
+        self.raw.add(now, self._values, valid)
+        self.minute.add(now, self._values, valid)
+
+    def bytes(self):
+        """
+        Returns the memory used by all the tiers
+        """
+        return self.raw.bytes() + self.minute.bytes() + self.hour.bytes()
+
+    def _header(self, tier):
+        """
+        Returns the CSV header line of a tier
+        """
+        if tier is self.raw:
+            columns = self.names
+        else:
+            columns = []
+            for name in self.names:
+                columns += [name + ' min', name + ' mean', name + ' max']
+        return 'time,' + ','.join(columns) + '\n'
+
+    def _raw_row(self, tier, i):
+        """
+        Returns the CSV line of a raw sample
+        """
+        base = i * tier.fields
+        valid = tier.valid[i]
+        row = str(tier.times[i])
+        for field in range(tier.fields):
+            if valid & (1 << field):
+                row += ',{:.1f}'.format(tier.values[base + field])
+            else:
+                row += ','
+        return row + '\n'
+
+    def _rollup_row(self, tier, i):
+        """
+        Returns the CSV line of a rollup
+        """
+        base = i * tier.fields
+        row = str(tier.times[i])
+        for field in range(tier.fields):
+            if tier.counts[base + field]:
+                row += ',{:.1f},{:.1f},{:.1f}'.format(tier.mins[base + field],
+                                                      tier.means[base + field],
+                                                      tier.maxs[base + field])
+            else:
+                row += ',,,'
+        return row + '\n'
+
+    def _lines(self, tier, since):
+        """
+        Generate the CSV lines of the entries of a tier at or after `since`
+        """
+        yield self._header(tier)
+        row = self._raw_row if tier is self.raw else self._rollup_row
+        for i in tier.entries():
+            if tier.times[i] >= since:
+                yield row(tier, i)
+
+    def csv(self, tier, since, buffer):
+        """
+        Generate the entries of a tier at or after `since` as CSV.
+        Lines are collected in `buffer`, which is yielded as a memoryview
+        whenever it is full, so the output is never held in one string.
+        """
+        view = memoryview(buffer)
+        size = len(buffer)
+        used = 0
+        for line in self._lines(tier, since):
+            data = line.encode()
+            if used + len(data) > size:
+                if used:
+                    yield view[:used]
+                    used = 0
+                if len(data) > size:
+                    yield data
+                    continue
+            view[used:used + len(data)] = data
+            used += len(data)
+
+        if used:
+            yield view[:used]
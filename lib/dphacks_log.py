@@ -0,0 +1,385 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Append-only log of sample records on the CIRCUITPY filesystem, so readings
+# survive reboots and network outages.
+#
+# The log is written in blocks of BLOCK_SIZE bytes. Each block starts with an
+# 8 byte header: magic, format version, number of records and the timestamp
+# the records in the block count from. Every record is
+#   varint  seconds since the previous record (the block timestamp for the first)
+#   varint  valid mask of the sample record
+#   zigzag varint per valid field, the change from the previous value of that
+#           field in the block (from 0 for the first)
+# Temperature and humidity are stored in hundredths, the PM fields as integers.
+# Blocks decode on their own, so a reader can start at any of them.
+#
+# The block being filled is kept in RAM and only written once it is full, so
+# the flash is always written 512 bytes at a time. When the log file reaches
+# max_size it is renamed to <path>.1, replacing the older one.
+#
+# The board has no battery backed clock, time.time() starts over from
+# 2000-01-01 at every boot. So timestamps never go back in the log, they are
+# shifted to count on from the last record logged until the clock passes it.
+# Blocks stay in time order across files and boots and the block index can
+# be searched.
+#
+# This module runs on CPython too, tools/decode_log.py uses it to read logs.
+
+
+import os
+import struct
+import array
+
+MAGIC = b'PL'
+VERSION = 1
+BLOCK_SIZE = 512
+HEADER = '<2sBBL'
+HEADER_SIZE = 8
+
+# Multiplier of each sample field, in dphacks_sample.FIELDS order
+SCALES = (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 100, 100)
+# Largest record: timestamp, mask and a value for every field, 5 bytes each
+RECORD_MAX = 5 * (2 + len(SCALES))
+
+
+def put_varint(buffer, pos, value):
+    """
+    Write an unsigned varint into buffer at pos. Returns the position after it.
+    """
+    while value > 0x7F:
+        buffer[pos] = (value & 0x7F) | 0x80
+        value >>= 7
+        pos += 1
+    buffer[pos] = value
+    return pos + 1
+
+def get_varint(buffer, pos):
+    """
+    Read an unsigned varint from buffer at pos. Returns the value and the
+    position after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def zigzag(value):
+    """
+    Map signed integers to unsigned ones, small changes stay small
+    """
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    """
+    Undo zigzag()
+    """
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+def block_time(block):
+    """
+    Returns the timestamp of a block, or None if it isn't a log block
+    """
+    magic, version, count, base = struct.unpack_from(HEADER, block)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return base
+
+def decode_block(block, since=0):
+    """
+    Generate (timestamp, valid mask, values) for every record in a block at
+    or after `since`. values is a list with a float per field, 0.0 where the
+    field is not valid.
+    """
+    magic, version, count, now = struct.unpack_from(HEADER, block)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a sample log block")
+
+    fields = len(SCALES)
+    last = [0] * fields
+    pos = HEADER_SIZE
+    for n in range(count):
+        delta, pos = get_varint(block, pos)
+        now += delta
+        valid, pos = get_varint(block, pos)
+        values = [0.0] * fields
+        for field in range(fields):
+            if valid & (1 << field):
+                change, pos = get_varint(block, pos)
+                last[field] += unzigzag(change)
+                values[field] = last[field] / SCALES[field]
+        if now >= since:
+            yield now, valid, values
+
+def index_file(f, index):
+    """
+    Append the timestamps of the blocks of an open log file to an index.
+    Stops at the first block that is cut short or isn't a log block.
+    Returns the number of blocks.
+    """
+    header = bytearray(HEADER_SIZE)
+    # Only whole blocks count
+    f.seek(0, 2)
+    whole = f.tell() // BLOCK_SIZE
+    blocks = 0
+    while blocks < whole:
+        f.seek(blocks * BLOCK_SIZE)
+        f.readinto(header)
+        base = block_time(header)
+        if base is None:
+            break
+        index.append(base)
+        blocks += 1
+    return blocks
+
+def first_block(index, since):
+    """
+    Returns the number of the first block of an index that can have records
+    at or after `since`: the last one starting before it.
+    """
+    low = 0
+    high = len(index)
+    while low < high:
+        middle = (low + high) // 2
+        if index[middle] < since:
+            low = middle + 1
+        else:
+            high = middle
+    return max(low - 1, 0)
+
+def read_blocks(f, index, since, buffer):
+    """
+    Generate the blocks of an open log file that can have records at or after
+    `since`, read into `buffer` one after the other
+    """
+    first = first_block(index, since)
+    f.seek(first * BLOCK_SIZE)
+    for n in range(first, len(index)):
+        if f.readinto(buffer) != BLOCK_SIZE:
+            return
+        yield buffer
+
+def read_file(f, since=0):
+    """
+    Generate the records of an open log file at or after `since`, as
+    decode_block does. Uses the block index to skip older blocks.
+    """
+    index = array.array('L')
+    index_file(f, index)
+    for block in read_blocks(f, index, since, bytearray(BLOCK_SIZE)):
+        yield from decode_block(block, since)
+
+
+class SampleLog:
+    """
+    Append-only log of sample records in the file at `path`
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.old_path = path + '.1'
+        self.max_blocks = max(max_size // BLOCK_SIZE, 1)
+
+        # Timestamps of the blocks in the old and the current file, to find
+        # where to start reading without going through the files
+        self._old_index = array.array('L')
+        self._index = array.array('L')
+
+        # Block being filled
+        self._block = bytearray(BLOCK_SIZE)
+        self._pos = HEADER_SIZE
+        self._count = 0
+        # Log time of the last record and the shift from the board's clock
+        self._time = 0
+        self._offset = 0
+        self._base = 0
+        self._last = array.array('l', [0] * len(SCALES))
+
+        # Blocks are read into this buffer when streaming them
+        self._read_buffer = bytearray(BLOCK_SIZE)
+
+        self._load()
+
+    def _scan(self, path, index):
+        """
+        Read the block timestamps of a log file into an index.
+        Returns True if the file ends after the last good block.
+        """
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            return False
+
+        with open(path, 'rb') as f:
+            blocks = index_file(f, index)
+        return size != blocks * BLOCK_SIZE
+
+    def _load(self):
+        """
+        Index the log files left from before the last restart
+        """
+        self._scan(self.old_path, self._old_index)
+        # A block that was cut short or damaged would misalign every block
+        # appended after it, start a new file instead
+        if self._scan(self.path, self._index):
+            self._rotate()
+
+        if self._index:
+            self._time = self._last_time(self.path, self._index)
+        elif self._old_index:
+            self._time = self._last_time(self.old_path, self._old_index)
+
+    def _last_time(self, path, index):
+        """
+        Returns the time of the last record in a log file
+        """
+        last = index[-1]
+        with open(path, 'rb') as f:
+            f.seek((len(index) - 1) * BLOCK_SIZE)
+            f.readinto(self._read_buffer)
+        for last, valid, values in decode_block(self._read_buffer):
+            pass
+        return last
+
+    def log_time(self, now):
+        """
+        Returns the log time of a record taken at `now`, never earlier than
+        the last record. After the clock went back, like after a restart, the
+        log time counts on from a second after the last record until the
+        clock catches up.
+        """
+        if now >= self._time:
+            self._offset = 0
+        elif now + self._offset < self._time:
+            self._offset = self._time - now + 1
+        return now + self._offset
+
+    def _rotate(self):
+        """
+        Make the current file the old one and start a new one
+        """
+        try:
+            os.remove(self.old_path)
+        except OSError:
+            pass
+        try:
+            os.rename(self.path, self.old_path)
+        except OSError:
+            pass
+        self._old_index = self._index
+        self._index = array.array('L')
+
+    def _start_block(self, now):
+        """
+        Start an empty block counting from `now`
+        """
+        self._pos = HEADER_SIZE
+        self._count = 0
+        self._time = now
+        self._base = now
+        for field in range(len(SCALES)):
+            self._last[field] = 0
+        struct.pack_into(HEADER, self._block, 0, MAGIC, VERSION, 0, now)
+
+    def _write_block(self):
+        """
+        Append the block to the log file, rotating it first if it is full
+        """
+        if len(self._index) >= self.max_blocks:
+            self._rotate()
+
+        # Clear the unused end so the flash image doesn't keep stale records
+        for i in range(self._pos, BLOCK_SIZE):
+            self._block[i] = 0
+        with open(self.path, 'ab') as f:
+            f.write(self._block)
+        self._index.append(self._base)
+
+    def append(self, sample, now):
+        """
+        Add a sample record taken at `now` (whole seconds) to the log. It is
+        logged at log_time(now).
+        """
+        now = self.log_time(now)
+        # Write the block once the next record may not fit
+        if self._count and (BLOCK_SIZE - self._pos < RECORD_MAX or self._count == 255):
+            self._write_block()
+            self._count = 0
+        if not self._count:
+            self._start_block(now)
+
+        block = self._block
+        pos = put_varint(block, self._pos, now - self._time)
+        valid = sample.valid & ((1 << len(SCALES)) - 1)
+        pos = put_varint(block, pos, valid)
+        for field in range(len(SCALES)):
+            if valid & (1 << field):
+                value = round(sample.values[field] * SCALES[field])
+                pos = put_varint(block, pos, zigzag(value - self._last[field]))
+                self._last[field] = value
+
+        self._pos = pos
+        self._time = now
+        self._count += 1
+        block[3] = self._count
+
+    def _file_blocks(self, path, index, until, since):
+        """
+        Generate the blocks of a log file that can have records at or after
+        `since`. `until` is the time the blocks after the file start from.
+        """
+        if not index or (until is not None and until < since):
+            return
+        view = memoryview(self._read_buffer)
+        with open(path, 'rb') as f:
+            for block in read_blocks(f, index, since, self._read_buffer):
+                yield view
+
+    def blocks(self, since=0):
+        """
+        Generate the blocks with records at or after `since`, oldest first,
+        ending with the block still in RAM. Blocks from the files are yielded
+        as a view of one buffer that is reused for the next block.
+        """
+        ram_time = self._base if self._count else None
+        until = self._index[0] if self._index else ram_time
+        yield from self._file_blocks(self.old_path, self._old_index, until, since)
+        yield from self._file_blocks(self.path, self._index, ram_time, since)
+        if self._count:
+            yield memoryview(self._block)
+
+    def records(self, since=0):
+        """
+        Generate the records at or after `since` as decode_block does
+        """
+        for block in self.blocks(since):
+            yield from decode_block(block, since)
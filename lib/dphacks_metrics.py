@@ -0,0 +1,160 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Counters, gauges and latency histograms served on /metrics in the Prometheus
+# text format. Recording a value only adds to numbers allocated up front, the
+# text is built when the metrics are scraped. Durations are measured with
+# time.monotonic_ns(), time.monotonic() loses its precision after some hours.
+
+
+import array
+import time
+
+PREFIX = 'picoair_'
+
+# Upper bounds of the latency histogram buckets in microseconds, 1 ms to 5 s
+DURATION_BUCKETS = (1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000)
+
+
+def _label(name, value):
+    return '{' + name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"}'
+
+
+class Counter:
+    """
+    A count that only goes up. With a label, like the route of HTTP requests,
+    every label value has its own count. Counts kept elsewhere, like the
+    errors of the PMS5003 driver, are collected with read when scraped.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None, read=None):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        self.read = read
+        self.value = 0
+        self.values = {}
+
+    def inc(self, label=None, amount=1):
+        if self.label is None:
+            self.value += amount
+        else:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def lines(self):
+        if self.label is not None:
+            for value, count in self.values.items():
+                yield '{}{} {}\n'.format(self.name, _label(self.label, value), count)
+        else:
+            yield '{} {}\n'.format(self.name, self.read() if self.read else self.value)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, set or collected with read when scraped
+    """
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """
+    Counts durations in fixed buckets. Call start() before the measured code
+    and done() with its result after it.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = array.array('L', buckets)
+        self.counts = array.array('L', [0] * len(buckets))
+        self.count = 0
+        self.sum = 0
+
+    @staticmethod
+    def start():
+        return time.monotonic_ns()
+
+    def done(self, start):
+        """
+        Record the time since start, returns it in microseconds
+        """
+        micros = (time.monotonic_ns() - start) // 1000
+        self.observe(micros)
+        return micros
+
+    def observe(self, micros):
+        self.count += 1
+        self.sum += micros
+        buckets = self.buckets
+        for i in range(len(buckets)):
+            if micros <= buckets[i]:
+                self.counts[i] += 1
+                break
+
+    def lines(self):
+        total = 0
+        for i in range(len(self.buckets)):
+            total += self.counts[i]
+            yield '{}_bucket{{le="{}"}} {}\n'.format(self.name, self.buckets[i] / 1000000, total)
+        yield '{}_bucket{{le="+Inf"}} {}\n'.format(self.name, self.count)
+        yield '{}_sum {}\n'.format(self.name, self.sum / 1000000)
+        yield '{}_count {}\n'.format(self.name, self.count)
+
+
+class Metrics:
+    """
+    All the metrics of the firmware, in the order they are served
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None, read=None):
+        return self._add(Counter(name, help, label, read))
+
+    def gauge(self, name, help, read=None):
+        return self._add(Gauge(name, help, read=read))
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def lines(self):
+        """
+        Yields the metrics in the Prometheus text format, a metric at a time
+        """
+        for metric in self.metrics:
+            yield '# HELP {} {}\n# TYPE {} {}\n{}'.format(metric.name, metric.help,
+                                                         metric.name, metric.kind,
+                                                         ''.join(metric.lines()))
@@ -0,0 +1,221 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Store-and-forward for MQTT messages. Messages wait in a bounded queue in RAM
+# until they are published, so measurements taken while the broker or the WiFi
+# is down are sent once it is back. When the queue is full the oldest messages
+# can spill over to a file on flash instead of being dropped.
+# Backoff spaces out the reconnection attempts.
+
+
+import os
+import time
+import random
+import struct
+
+# Spill file record header: message length, topic length and retain flag
+SPILL_HEADER = '<HHB'
+SPILL_HEADER_SIZE = 5
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter. After every failure the delay doubles,
+    up to `maximum` seconds, and the actual wait is a random time between half
+    of it and all of it so that many boards don't retry in step.
+    """
+
+    def __init__(self, base=1, maximum=300):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self._next = 0
+
+    def ready(self, now=None):
+        """
+        Returns True when it is time for the next attempt
+        """
+        return (time.monotonic() if now is None else now) >= self._next
+
+    def failed(self, now=None):
+        """
+        Record a failed attempt and schedule the next one.
+        Returns the delay until then in seconds.
+        """
+        if now is None:
+            now = time.monotonic()
+        delay = min(self.base * (2 ** self.failures), self.maximum)
+        if delay < self.maximum:
+            self.failures += 1
+        delay = delay / 2 + random.random() * delay / 2
+        self._next = now + delay
+        return delay
+
+    def succeeded(self):
+        """
+        Record a successful attempt, the next failure starts over from `base`
+        """
+        self.failures = 0
+        self._next = 0
+
+
+class Outbox:
+    """
+    Queue of at most `size` messages in RAM. With a `spill_path`, messages that
+    don't fit are moved to that file, up to `spill_max` bytes of it. Messages
+    that fit nowhere are dropped, oldest first, and counted in `dropped`.
+    Messages come out oldest first, as (topic, message, retain) tuples.
+    """
+
+    def __init__(self, size, spill_path=None, spill_max=0):
+        self.size = size
+        self._messages = []
+        self.spill_path = spill_path if spill_max else None
+        self.spill_max = spill_max
+        self.dropped = 0
+
+        # Bytes written to the spill file and read back from it, and the
+        # number of messages in it that weren't sent yet
+        self._spill_size = 0
+        self._spill_read = 0
+        self.spilled = 0
+        # Next spilled message, once it was read from the file, and its size there
+        self._spilled = None
+        self._spilled_size = 0
+
+        if self.spill_path:
+            self._count_spilled()
+
+    def __len__(self):
+        return len(self._messages) + self.spilled
+
+    def _count_spilled(self):
+        """
+        Count the messages spilled before a restart, they are sent again
+        """
+        try:
+            with open(self.spill_path, 'rb') as f:
+                while True:
+                    header = f.read(SPILL_HEADER_SIZE)
+                    if len(header) != SPILL_HEADER_SIZE:
+                        break
+                    length, topic_length, retain = struct.unpack(SPILL_HEADER, header)
+                    f.seek(topic_length + length, 1)
+                    self._spill_size += SPILL_HEADER_SIZE + topic_length + length
+                    self.spilled += 1
+        except OSError:
+            pass
+
+    def put(self, message, topic=None, retain=False):
+        """
+        Add a message, str or bytes, to the end of the queue. A topic of
+        None stands for the default topic of whoever sends the messages.
+        """
+        self._messages.append((topic, message, retain))
+        if len(self._messages) > self.size:
+            self._spill(self._messages.pop(0))
+
+    def _spill(self, entry):
+        """
+        Append a queued message to the spill file, or drop it if there is no room
+        """
+        topic, message, retain = entry
+        if isinstance(message, str):
+            message = message.encode()
+        topic = topic.encode() if topic else b''
+        size = SPILL_HEADER_SIZE + len(topic) + len(message)
+        if not self.spill_path or self._spill_size + size > self.spill_max:
+            self.dropped += 1
+            return
+        try:
+            with open(self.spill_path, 'ab') as f:
+                f.write(struct.pack(SPILL_HEADER, len(message), len(topic), retain))
+                f.write(topic)
+                f.write(message)
+            self._spill_size += size
+            self.spilled += 1
+        except OSError:
+            self.dropped += 1
+
+    def peek(self):
+        """
+        Returns the oldest (topic, message, retain) without removing it, or None
+        """
+        if self.spilled:
+            if self._spilled is None:
+                self._spilled = self._read_spilled()
+            if self._spilled is not None:
+                return self._spilled
+        if self._messages:
+            return self._messages[0]
+        return None
+
+    def pop(self):
+        """
+        Remove the oldest message, once it was sent
+        """
+        if self._spilled is not None:
+            self._spill_read += self._spilled_size
+            self._spilled = None
+            self.spilled -= 1
+            if not self.spilled:
+                self._clear_spill()
+        elif self._messages:
+            self._messages.pop(0)
+
+    def _read_spilled(self):
+        """
+        Read the next message from the spill file. A damaged file is dropped.
+        """
+        try:
+            with open(self.spill_path, 'rb') as f:
+                f.seek(self._spill_read)
+                header = f.read(SPILL_HEADER_SIZE)
+                if len(header) == SPILL_HEADER_SIZE:
+                    length, topic_length, retain = struct.unpack(SPILL_HEADER, header)
+                    topic = f.read(topic_length).decode() if topic_length else None
+                    message = f.read(length)
+                    if len(message) == length:
+                        self._spilled_size = SPILL_HEADER_SIZE + topic_length + length
+                        return topic, message, bool(retain)
+        except OSError:
+            pass
+        self._clear_spill()
+        return None
+
+    def _clear_spill(self):
+        """
+        Delete the spill file once all of it was sent
+        """
+        self._spill_size = 0
+        self._spill_read = 0
+        self._spilled = None
+        self.spilled = 0
+        try:
+            os.remove(self.spill_path)
+        except OSError:
+            pass
@@ -0,0 +1,292 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Batched MQTT payloads. Instead of one JSON message per measurement, MQTT_BATCH
+# measurements are collected and sent as one message, column by column with a
+# single list of field names. Two encodings are available:
+#
+# "json", compact JSON:
+#   {"v":1,"t":[<first timestamp>,<seconds since the previous one>,...],
+#    "f":["pm25 env",...],"d":[[<pm25 env values>],...]}
+#   with null where a field wasn't measured.
+#
+# "binary", packed:
+#   header   magic b'PB', version, number of rows, number of columns and the
+#            first timestamp (struct '<2sBBBL', 9 bytes)
+#   columns  one byte per column, its index in COLUMNS. New columns are only
+#            added at the end, decoders skip the ones they don't know.
+#   rows     varint seconds since the previous row and varint mask of the
+#            columns measured in it
+#   values   column by column, the zigzag varint change from the previous
+#            value of the column, in the units of SCALES
+#
+# decode() reads both, and the single measurement JSON messages, on CPython or
+# on the board.
+
+
+import json
+import struct
+import array
+
+from dphacks_sample import FIELDS, NUM_FIELDS
+from dphacks_log import put_varint, get_varint, zigzag, unzigzag
+
+# Everything a batch can carry, the same numbers as the single measurement
+# messages: the sample record fields, the AQIs and the NowCast concentration
+COLUMNS = FIELDS + ('aqi', 'aqi pm25', 'aqi pm100', 'aqi nowcast', 'nowcast pm25')
+AQI = NUM_FIELDS
+AQI_PM25 = NUM_FIELDS + 1
+AQI_PM100 = NUM_FIELDS + 2
+AQI_NOWCAST = NUM_FIELDS + 3
+NOWCAST_PM25 = NUM_FIELDS + 4
+NUM_COLUMNS = len(COLUMNS)
+
+# Columns are sent as integers in these units, temperature and humidity in
+# hundredths, the NowCast in tenths as it is truncated to
+SCALES = tuple(100 if name in ('temperature', 'humidity') else 10 if name == 'nowcast pm25' else 1
+               for name in COLUMNS)
+
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = (JSON, BINARY)
+
+MAGIC = b'PB'
+VERSION = 1
+HEADER = '<2sBBBL'
+HEADER_SIZE = 9
+
+
+class Batch:
+    """
+    Ring of the last `size` rows of COLUMNS values to send in one message.
+    When it is full the oldest row is replaced.
+    """
+
+    def __init__(self, size, encoding=JSON):
+        if encoding not in ENCODINGS:
+            raise ValueError("MQTT encoding must be one of " + ', '.join(ENCODINGS))
+        if not 1 <= size <= 255:
+            raise ValueError("Batch size must be between 1 and 255")
+        self.size = size
+        self.encoding = encoding
+        self.times = array.array('L', [0] * size)
+        self.values = array.array('f', [0.0] * (size * NUM_COLUMNS))
+        self.valid = array.array('L', [0] * size)
+        self.length = 0
+        self.index = 0
+
+        # Binary messages are packed here, large enough for a full batch
+        self._buffer = bytearray(HEADER_SIZE + NUM_COLUMNS + size * (5 + 4 + 5 * NUM_COLUMNS))
+        self._last = array.array('l', [0] * NUM_COLUMNS)
+
+    def add(self, now, values, valid):
+        """
+        Add a row taken at `now` (whole seconds). values holds a value per
+        column and bit i of valid is set when values[i] was measured.
+        """
+        i = self.index
+        base = i * NUM_COLUMNS
+        self.times[i] = now
+        self.valid[i] = valid
+        for column in range(NUM_COLUMNS):
+            if valid & (1 << column):
+                self.values[base + column] = values[column]
+
+        self.index = (i + 1) % self.size
+        if self.length < self.size:
+            self.length += 1
+
+    def full(self):
+        """
+        Returns True when the batch has `size` rows
+        """
+        return self.length == self.size
+
+    def clear(self):
+        """
+        Forget all rows
+        """
+        self.length = 0
+        self.index = 0
+
+    def rows(self):
+        """
+        Iterate over the ring positions from the oldest row to the newest
+        """
+        start = (self.index - self.length) % self.size
+        for n in range(self.length):
+            yield (start + n) % self.size
+
+    def _columns(self):
+        """
+        Returns the columns measured in any of the rows, as a list of indexes
+        """
+        used = 0
+        for i in self.rows():
+            used |= self.valid[i]
+        return [column for column in range(NUM_COLUMNS) if used & (1 << column)]
+
+    def encode(self):
+        """
+        Returns the rows as a message in the batch encoding
+        """
+        if self.encoding == BINARY:
+            return self.encode_binary()
+        return self.encode_json()
+
+    def encode_json(self):
+        """
+        Returns the rows as compact column oriented JSON
+        """
+        columns = self._columns()
+        times = []
+        last = None
+        for i in self.rows():
+            times.append(str(self.times[i] if last is None else self.times[i] - last))
+            last = self.times[i]
+
+        data = []
+        for column in columns:
+            scale = SCALES[column]
+            cells = []
+            for i in self.rows():
+                if not self.valid[i] & (1 << column):
+                    cells.append('null')
+                    continue
+                value = self.values[i * NUM_COLUMNS + column]
+                if scale == 1:
+                    cells.append(str(round(value)))
+                else:
+                    cells.append(str(round(value * scale) / scale))
+            data.append('[' + ','.join(cells) + ']')
+
+        names = ['"' + COLUMNS[column] + '"' for column in columns]
+        return ('{"v":1,"t":[' + ','.join(times) + '],"f":[' + ','.join(names)
+                + '],"d":[' + ','.join(data) + ']}')
+
+    def encode_binary(self):
+        """
+        Returns the rows packed in the binary encoding
+        """
+        columns = self._columns()
+        buffer = self._buffer
+        first = self.times[(self.index - self.length) % self.size] if self.length else 0
+        struct.pack_into(HEADER, buffer, 0, MAGIC, VERSION, self.length, len(columns), first)
+        pos = HEADER_SIZE
+        for column in columns:
+            buffer[pos] = column
+            pos += 1
+
+        last = first
+        for i in self.rows():
+            pos = put_varint(buffer, pos, self.times[i] - last)
+            last = self.times[i]
+            mask = 0
+            for bit, column in enumerate(columns):
+                if self.valid[i] & (1 << column):
+                    mask |= 1 << bit
+            pos = put_varint(buffer, pos, mask)
+
+        for column in columns:
+            scale = SCALES[column]
+            previous = 0
+            for i in self.rows():
+                if self.valid[i] & (1 << column):
+                    value = round(self.values[i * NUM_COLUMNS + column] * scale)
+                    pos = put_varint(buffer, pos, zigzag(value - previous))
+                    previous = value
+
+        return bytes(memoryview(buffer)[:pos])
+
+
+def decode_binary(payload):
+    """
+    Returns the rows of a binary batch as a list of (timestamp, values) where
+    values is a dictionary of the measured fields. Columns added after this
+    version of COLUMNS are left out.
+    """
+    magic, version, count, ncolumns, now = struct.unpack_from(HEADER, payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a binary batch payload")
+
+    pos = HEADER_SIZE
+    columns = [payload[pos + n] for n in range(ncolumns)]
+    pos += ncolumns
+
+    rows = []
+    masks = []
+    for n in range(count):
+        delta, pos = get_varint(payload, pos)
+        now += delta
+        mask, pos = get_varint(payload, pos)
+        rows.append((now, {}))
+        masks.append(mask)
+
+    for bit, column in enumerate(columns):
+        known = column < NUM_COLUMNS
+        name = COLUMNS[column] if known else None
+        scale = SCALES[column] if known else 1
+        value = 0
+        for n in range(count):
+            if masks[n] & (1 << bit):
+                change, pos = get_varint(payload, pos)
+                value += unzigzag(change)
+                if known:
+                    rows[n][1][name] = value if scale == 1 else value / scale
+
+    return rows
+
+def decode_json(message):
+    """
+    Returns the rows of a decoded JSON batch as decode_binary does
+    """
+    rows = []
+    now = 0
+    for delta in message['t']:
+        now += delta
+        rows.append((now, {}))
+
+    for name, cells in zip(message['f'], message['d']):
+        for n, value in enumerate(cells):
+            if value is not None:
+                rows[n][1][name] = value
+
+    return rows
+
+def decode(payload):
+    """
+    Decode any MQTT payload sent by the board: binary or JSON batches, or a
+    single measurement. Returns a list of (timestamp, values) rows, single
+    measurements have no timestamp and come back as (None, message).
+    """
+    if payload[:2] == MAGIC:
+        return decode_binary(payload)
+
+    message = json.loads(payload)
+    if 'f' in message and 'd' in message and 't' in message:
+        return decode_json(message)
+    return [(None, message)]
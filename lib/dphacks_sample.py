@@ -0,0 +1,127 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+
+# Fixed schema sample record. Every measurement the Pico W Air takes is a column
+# of FIELDS, so the measurement loop carries numbers in a preallocated array
+# instead of dictionaries. Dictionaries are only built for JSON output.
+
+
+import array
+
+# Column names, in PMS5003 data frame order followed by the environment sensor
+FIELDS = ('pm10 standard', 'pm25 standard', 'pm100 standard',
+          'pm10 env', 'pm25 env', 'pm100 env',
+          'particles 03um', 'particles 05um', 'particles 10um',
+          'particles 25um', 'particles 50um', 'particles 100um',
+          'temperature', 'humidity')
+
+# Column indexes
+PM10_STANDARD = 0
+PM25_STANDARD = 1
+PM100_STANDARD = 2
+PM10_ENV = 3
+PM25_ENV = 4
+PM100_ENV = 5
+PARTICLES_03UM = 6
+PARTICLES_05UM = 7
+PARTICLES_10UM = 8
+PARTICLES_25UM = 9
+PARTICLES_50UM = 10
+PARTICLES_100UM = 11
+TEMPERATURE = 12
+HUMIDITY = 13
+
+NUM_FIELDS = len(FIELDS)
+# The PMS5003 fields are the first PM_COUNT columns
+PM_COUNT = 12
+
+# Steps per unit the fields are kept in when summed as integers: the PM fields
+# in tenths, temperature and humidity in hundredths
+SCALES = (10,) * PM_COUNT + (100, 100)
+
+def field_index(name):
+    """
+    Returns the column index of a field name, or None if there is no such field
+    """
+    for i, field in enumerate(FIELDS):
+        if field == name:
+            return i
+    return None
+
+
+class Sample:
+    """
+    One set of measurements. `values` holds a float per column and bit N of
+    `valid` is set when column N holds a measurement.
+    """
+    __slots__ = ('values', 'valid')
+
+    def __init__(self):
+        self.values = array.array('f', [0.0] * NUM_FIELDS)
+        self.valid = 0
+
+    def set(self, field, value):
+        self.values[field] = value
+        self.valid |= 1 << field
+
+    def unset(self, field):
+        self.valid &= ~(1 << field)
+
+    def has(self, field):
+        return bool(self.valid & (1 << field))
+
+    def get(self, field, default=None):
+        if self.valid & (1 << field):
+            return self.values[field]
+        return default
+
+    def clear(self):
+        self.valid = 0
+
+    def copy_from(self, other):
+        """
+        Copy another sample record into this one without allocating
+        """
+        values = self.values
+        other_values = other.values
+        for field in range(NUM_FIELDS):
+            values[field] = other_values[field]
+        self.valid = other.valid
+
+    def to_dict(self, first=0, last=NUM_FIELDS, ndigits=None):
+        """
+        Returns the valid fields between the first and last column as a dictionary.
+        Values are rounded to ndigits, or to an integer if ndigits is None.
+        """
+        data = {}
+        for field in range(first, last):
+            if self.valid & (1 << field):
+                if ndigits is None:
+                    data[FIELDS[field]] = round(self.values[field])
+                else:
+                    data[FIELDS[field]] = round(self.values[field], ndigits)
+        return data
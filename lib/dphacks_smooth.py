@@ -0,0 +1,117 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Moving average of sensor measurements over the last SMOOTH values.
+# Every field of the sample record gets a preallocated ring buffer and a running
+# sum, so adding a value and reading the average are O(1) and don't allocate memory.
+# Values are stored as integers in steps of 1/scale. Floats on the board are
+# single precision, a float sum of particle counts would lose the last digits,
+# the integer sums stay exact however long they run.
+
+
+import array
+
+
+class Smoother:
+    """
+    Keeps the last `size` values of each of the `fields` columns of a sample
+    record, in steps of 1/scale of the field (1 without `scales`). All memory
+    is allocated up front.
+    """
+
+    def __init__(self, size, fields, scales=None):
+        if size < 1:
+            raise ValueError("Smoothing size must be at least 1")
+        self._size = size
+        self._fields = fields
+        self._scales = scales if scales else (1,) * fields
+        self._rings = array.array('l', [0] * (size * fields))
+        self._sums = array.array('l', [0] * fields)
+        self._index = array.array('H', [0] * fields)
+        self._count = array.array('H', [0] * fields)
+
+    def add(self, sample):
+        """
+        Add every valid field of a sample record
+        """
+        values = sample.values
+        valid = sample.valid
+        for field in range(self._fields):
+            if valid & (1 << field):
+                self.add_value(field, values[field])
+
+    def add_value(self, field, value):
+        """
+        Add a single measurement, replacing the oldest one once the ring is full
+        """
+        ring = self._rings
+        base = field * self._size
+        i = self._index[field]
+        value = round(value * self._scales[field])
+
+        if self._count[field] == self._size:
+            self._sums[field] -= ring[base + i]
+        else:
+            self._count[field] += 1
+
+        ring[base + i] = value
+        self._sums[field] += value
+
+        i += 1
+        if i == self._size:
+            i = 0
+        self._index[field] = i
+
+    def average(self, field):
+        """
+        Returns the average of a field, or None if it has no values
+        """
+        count = self._count[field]
+        if not count:
+            return None
+        return self._sums[field] / (count * self._scales[field])
+
+    def average_into(self, sample):
+        """
+        Write the average of every field that has values into a sample record.
+        Fields without values are marked as not valid.
+        """
+        for field in range(self._fields):
+            count = self._count[field]
+            if count:
+                sample.set(field, self._sums[field] / (count * self._scales[field]))
+            else:
+                sample.unset(field)
+        return sample
+
+    def clear(self):
+        """
+        Forget all values but keep the allocated rings
+        """
+        for field in range(self._fields):
+            self._sums[field] = 0
+            self._index[field] = 0
+            self._count[field] = 0
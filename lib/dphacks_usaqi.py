@@ -29,6 +29,8 @@
 
 
 import math
+import time
+import array
 
 ## Breakpoints
 # PM2.5 (ug/m3)
@@ -45,6 +47,18 @@ AQI_INFO = [{'category': 'Good', 'color':'Green', 'rgb':[0, 228, 0]},
             {'category': 'Very Unhealthy', 'color':'Purple', 'rgb':[143, 63, 151]},
             {'category': 'Hazardous', 'color':'Maroon', 'rgb':[126, 0, 35]}]
 
+# Highest AQI of each AQI_INFO category. Both of the top AQI ranges are Hazardous.
+CATEGORY_MAX = (50, 100, 150, 200, 300)
+
+# Lookup tables of the AQI by concentration, built on first use.
+# PM2.5 is indexed by tenths of ug/m3 and PM10 by whole ug/m3, which is the
+# precision the EPA truncates concentrations to. Concentrations above the last
+# breakpoint are calculated with the formula.
+PM25_TABLE_SIZE = 5005
+PM100_TABLE_SIZE = 605
+_pm25_table = None
+_pm100_table = None
+
 def truncate(number, digits) -> float:
     """
     Truncate a floating point number to the correct number of decimal places.
@@ -58,9 +72,9 @@ def truncate(number, digits) -> float:
     stepper = 10.0 ** digits
     return math.trunc(stepper * number) / stepper
 
-def pm25_aqi(pm25_val):
+def _pm25_formula(pm25_val):
     """
-    Returns the AQI based on the PM2.5 concentration
+    Calculates the AQI based on the PM2.5 concentration
     """
     for i, values in enumerate(PM25):
         val = truncate(pm25_val, 1)
@@ -80,9 +94,9 @@ def pm25_aqi(pm25_val):
 
     return int(round(aqi_index))
 
-def pm100_aqi(pm100_val):
+def _pm100_formula(pm100_val):
     """
-    Returns the AQI based on the PM10 concentration
+    Calculates the AQI based on the PM10 concentration
     """
     for i, values in enumerate(PM100):
         # PM10 AQI uses concentration truncated to full integer
@@ -102,15 +116,296 @@ def pm100_aqi(pm100_val):
 
     return int(round(aqi_index))
 
+def build_tables():
+    """
+    Build the AQI lookup tables. This is done on the first AQI calculation,
+    call it at startup to take the time and memory (about 11kB) up front.
+    """
+    global _pm25_table, _pm100_table
+    if _pm25_table is None:
+        table = array.array('H', bytes(2 * PM25_TABLE_SIZE))
+        for tenths in range(PM25_TABLE_SIZE):
+            table[tenths] = _pm25_formula(tenths / 10)
+        _pm25_table = table
+
+    if _pm100_table is None:
+        table = array.array('H', bytes(2 * PM100_TABLE_SIZE))
+        for whole in range(PM100_TABLE_SIZE):
+            table[whole] = _pm100_formula(whole)
+        _pm100_table = table
+
+def _tenths(number):
+    """
+    Returns the PM2.5 concentration in tenths as truncated by truncate(),
+    or None if it has to go through the formula.
+    """
+    if isinstance(number, int):
+        return number * 10
+
+    text = str(number)
+    dot = text.find('.')
+    if dot < 0:
+        # Exponent notation, inf or nan
+        return None
+    if len(text) - dot <= 2:
+        # Already one decimal or less, round away the multiplication error
+        return round(number * 10)
+    return math.trunc(number * 10)
+
+def pm25_aqi(pm25_val):
+    """
+    Returns the AQI based on the PM2.5 concentration
+    """
+    if _pm25_table is None:
+        build_tables()
+
+    tenths = _tenths(pm25_val)
+    if tenths is not None and 0 <= tenths < PM25_TABLE_SIZE:
+        return _pm25_table[tenths]
+    return _pm25_formula(pm25_val)
+
+def pm100_aqi(pm100_val):
+    """
+    Returns the AQI based on the PM10 concentration
+    """
+    if _pm100_table is None:
+        build_tables()
+
+    whole = int(pm100_val)
+    if 0 <= whole < PM100_TABLE_SIZE:
+        return _pm100_table[whole]
+    return _pm100_formula(pm100_val)
+
+def pm_aqi(pm25_val, pm100_val):
+    """
+    Returns the overall AQI and the PM2.5 and PM10 AQIs as a tuple.
+    The overall AQI is the highest of the two. Concentrations that are None
+    are left out and their AQI is None.
+    """
+    pm25_index = None if pm25_val is None else pm25_aqi(pm25_val)
+    pm100_index = None if pm100_val is None else pm100_aqi(pm100_val)
+
+    if pm100_index is None or (pm25_index is not None and pm25_index >= pm100_index):
+        return pm25_index, pm25_index, pm100_index
+    return pm100_index, pm25_index, pm100_index
+
+def category(aqi):
+    """
+    Returns the index of the AQI_INFO category of an AQI
+    """
+    for i, highest in enumerate(CATEGORY_MAX):
+        if aqi <= highest:
+            return i
+    return len(CATEGORY_MAX)
+
 def aqi_info(aqi):
     """
     Returns the AQI Category, Color, and RGB values based on the AQI
     """
-    for i, values in enumerate(AQI):
-        if values[0] <= aqi <= values[1]:
-            break
+    info = AQI_INFO[category(aqi)]
+    return {'aqi': aqi,
+            'category': info['category'],
+            'color': info['color'],
+            'rgb': info['rgb']}
+
+## NowCast
+# AirNow reports PM2.5 as the EPA NowCast, a weighted average of the last 12
+# hourly averages: https://usepa.servicenowservices.com/airnow?id=kb_article_view&sysparm_article=KB0011856
+# The hourly averages are kept in a fixed ring of sums and counts, so adding a
+# measurement is O(1) and memory doesn't grow. The sums are integers in tenths
+# of ug/m3, a single precision float sum of an hour of measurements would
+# lose the last digits. The weighted average itself is
+# only recalculated when it is asked for after a measurement or a new hour.
+
+class NowCast:
+    """
+    Incremental NowCast of PM2.5 concentrations
+    """
+
+    def __init__(self, hours=12, period=3600):
+        self._hours = hours
+        self._period = period
+        self._sums = array.array('l', [0] * hours)
+        self._counts = array.array('H', [0] * hours)
+        # Ring position and number of the current hour
+        self._index = 0
+        self._hour = None
+        self._value = None
+        self._dirty = False
+
+    def _roll(self, now):
+        """
+        Move the ring to the hour of `now`, emptying the hours that passed
+        """
+        hour = int(now // self._period)
+        if self._hour is None:
+            self._hour = hour
+            return
+
+        passed = hour - self._hour
+        if passed <= 0:
+            return
+
+        for i in range(min(passed, self._hours)):
+            self._index = (self._index + 1) % self._hours
+            self._sums[self._index] = 0
+            self._counts[self._index] = 0
+        self._hour = hour
+        self._dirty = True
+
+    def add(self, pm25_val, now=None):
+        """
+        Add a PM2.5 concentration to the average of the current hour
+        """
+        self._roll(time.monotonic() if now is None else now)
+        i = self._index
+        if self._counts[i] < 0xFFFF:
+            self._sums[i] += round(pm25_val * 10)
+            self._counts[i] += 1
+        self._dirty = True
+
+    def _calculate(self):
+        """
+        Returns the NowCast of the hours in the ring, or None if there isn't
+        enough data. 2 of the last 3 hours must have measurements.
+        """
+        hours = self._hours
+        recent = 0
+        cmin = cmax = None
+        for i in range(hours):
+            j = (self._index - i) % hours
+            if self._counts[j]:
+                if i < 3:
+                    recent += 1
+                average = self._sums[j] / (self._counts[j] * 10)
+                if cmin is None or average < cmin:
+                    cmin = average
+                if cmax is None or average > cmax:
+                    cmax = average
+
+        if recent < 2:
+            return None
+
+        # Weight factor, the more the concentration changes the more recent
+        # hours count. It is never less than 0.5.
+        weight = cmin / cmax if cmax > 0 else 1.0
+        if weight < 0.5:
+            weight = 0.5
+
+        total = 0.0
+        weights = 0.0
+        factor = 1.0
+        for i in range(hours):
+            j = (self._index - i) % hours
+            if self._counts[j]:
+                total += factor * self._sums[j] / (self._counts[j] * 10)
+                weights += factor
+            factor *= weight
+
+        return math.trunc(total / weights * 10) / 10
+
+    def value(self, now=None):
+        """
+        Returns the NowCast PM2.5 concentration, truncated to 1 decimal place,
+        or None if there isn't enough data yet
+        """
+        self._roll(time.monotonic() if now is None else now)
+        if self._dirty:
+            self._value = self._calculate()
+            self._dirty = False
+        return self._value
+
+    def aqi(self, now=None):
+        """
+        Returns the AQI of the NowCast concentration, or None
+        """
+        value = self.value(now)
+        if value is None:
+            return None
+        return pm25_aqi(value)
+
+    def clear(self):
+        """
+        Forget all measurements
+        """
+        for i in range(self._hours):
+            self._sums[i] = 0
+            self._counts[i] = 0
+        self._hour = None
+        self._value = None
+        self._dirty = False
+
+## Batch calculations
+# These take a NumPy array or an array.array of concentrations and calculate
+# all of them at once. They need NumPy, so they are meant for re-scoring
+# archived readings on a computer. NumPy is only imported when they are called.
+
+def _batch_aqi(np, val, breakpoints):
+    """
+    Apply the AQI formula to concentrations that are already truncated.
+    Like the scalar functions, concentrations below 0 or above the last
+    breakpoint are extrapolated from the last breakpoint range.
+    """
+    bplow = np.array([values[0] for values in breakpoints], dtype=np.float64)
+    bphigh = np.array([values[1] for values in breakpoints], dtype=np.float64)
+    ilow = np.array([values[0] for values in AQI], dtype=np.float64)
+    ihigh = np.array([values[1] for values in AQI], dtype=np.float64)
+
+    i = np.searchsorted(bplow, val, side='right') - 1
+    i[(i < 0) | (val > bphigh[i])] = len(breakpoints) - 1
+
+    # Same operations in the same order as the scalar formula, so the
+    # results round the same way
+    aqi_index = (((ihigh[i] - ilow[i]) / (bphigh[i] - bplow[i]))*(val - bplow[i])) + ilow[i]
+
+    return np.rint(aqi_index).astype(np.int64)
+
+def _batch_values(np, values):
+    """
+    Returns the concentrations as a flat float64 NumPy array, the batch
+    functions give their results the shape of `values` again
+    """
+    val = np.asarray(values, dtype=np.float64).ravel()
+    if not np.isfinite(val).all():
+        raise ValueError("Concentrations must be finite numbers")
+    return val
+
+def category_batch(aqi):
+    """
+    Returns the AQI_INFO category index of every AQI in an array
+    """
+    import numpy as np
+    return np.searchsorted(np.array(CATEGORY_MAX), aqi, side='left').astype(np.uint8)
+
+def pm25_aqi_batch(pm25_values):
+    """
+    Returns the AQI and category index arrays of an array of PM2.5
+    concentrations. Gives the same results as pm25_aqi for every value.
+    """
+    import numpy as np
+    val = _batch_values(np, pm25_values)
+
+    # Truncate to 1 decimal place like truncate(). Values with 1 decimal
+    # or less are kept as they are.
+    truncated = np.where(np.rint(val * 10) / 10 == val, val, np.trunc(val * 10) / 10)
+    aqi = _batch_aqi(np, truncated, PM25)
 
-    data = {'aqi': aqi}
-    data.update(AQI_INFO[i]) 
+    # str() writes these in exponent notation, where truncate() depends on
+    # the digits. There are hardly ever any, leave them to the scalar path.
+    magnitude = np.abs(val)
+    for i in np.flatnonzero(((magnitude < 1e-4) & (val != 0)) | (magnitude >= 1e16)):
+        aqi[i] = pm25_aqi(float(val[i]))
+
+    aqi = aqi.reshape(np.shape(pm25_values))
+    return aqi, category_batch(aqi)
+
+def pm100_aqi_batch(pm100_values):
+    """
+    Returns the AQI and category index arrays of an array of PM10
+    concentrations. Gives the same results as pm100_aqi for every value.
+    """
+    import numpy as np
+    val = np.trunc(_batch_values(np, pm100_values))
 
-    return data
\ No newline at end of file
+    aqi = _batch_aqi(np, val, PM100).reshape(np.shape(pm100_values))
+    return aqi, category_batch(aqi)
@@ -74,14 +74,17 @@ class PMS5003Response:
                                    + " {:d} bytes".format(raw_data_len))
 
     def __init__(self, raw_data, *, frame_length_bytes):
+        # raw_data can be any buffer, including a memoryview into the driver's
+        # frame buffer, so it is decoded and checksummed in place without copies
         raw_data_len = len(raw_data)
         self.check_data_len(raw_data_len)
         self.raw_data = raw_data
-        self.data = struct.unpack(self.DATA_FMT, raw_data)
+        self.data = struct.unpack_from(self.DATA_FMT, raw_data)
         self.checksum = self.data[self.CHECKSUM_IDX]
 
         # Don't include the checksum bytes in the checksum calculation
-        checksum = sum(PMS5003_SOF) + sum(raw_data[:-2])
+        checksum = (sum(PMS5003_SOF) + sum(raw_data)
+                    - raw_data[raw_data_len - 2] - raw_data[raw_data_len - 1])
         if frame_length_bytes is None:
             checksum += (raw_data_len >> 256) + (raw_data_len & 0xff)
         else:
@@ -165,11 +168,143 @@ PM10 ug/m3 (atmos env):                                        {}
         return self.__repr__()
 
 
+class PMS5003FrameAssembler:
+    """
+    Assembles response frames incrementally from whatever bytes the UART has
+    waiting. Bytes are copied into a small ring buffer and fed through a
+    state machine one at a time, so poll() never waits on the serial port.
+    Frames with a bad length or checksum are counted and dropped.
+    """
+    # Parser states
+    _SOF_HIGH = 0
+    _SOF_LOW = 1
+    _LENGTH = 2
+    _BODY = 3
+
+    def __init__(self, serial, buffer_size=64):
+        self._serial = serial
+        self._ring = bytearray(buffer_size)
+        self._ring_mv = memoryview(self._ring)
+        self._head = 0
+        self._count = 0
+
+        self._frame = bytearray(PMS5003Data.FRAME_LEN)
+        self._frame_mv = memoryview(self._frame)
+        self._length_mv = self._frame_mv[2:4]
+        self._data_mv = self._frame_mv[4:PMS5003Data.FRAME_LEN]
+        self._cmd_mv = self._frame_mv[4:PMS5003CmdResponse.FRAME_LEN]
+        self._state = self._SOF_HIGH
+        self._pos = 0
+        self._end = 0
+
+        self.frames = 0
+        self.checksum_errors = 0
+        self.length_errors = 0
+
+    def reset(self):
+        """Drop any buffered bytes and partially assembled frame."""
+        self._head = 0
+        self._count = 0
+        self._state = self._SOF_HIGH
+
+    def _fill(self):
+        size = len(self._ring)
+        waiting = self._serial.in_waiting
+        space = size - self._count
+        if not waiting or not space:
+            return
+
+        # Only ask for bytes that are already waiting so readinto returns at once
+        tail = (self._head + self._count) % size
+        read_len = min(waiting, space, size - tail)
+        read_len = self._serial.readinto(self._ring_mv[tail:tail + read_len])
+        if read_len:
+            self._count += read_len
+
+    def poll(self):
+        """
+        Returns the next complete and valid frame, either PMS5003Data or
+        PMS5003CmdResponse, or None if no complete frame has arrived yet.
+        Unparsed bytes stay buffered for the next call.
+        """
+        self._fill()
+
+        ring = self._ring
+        size = len(ring)
+        while self._count:
+            byte = ring[self._head]
+            self._head = (self._head + 1) % size
+            self._count -= 1
+
+            response = self._feed(byte)
+            if response is not None:
+                return response
+
+        return None
+
+    def _feed(self, byte):
+        frame = self._frame
+        state = self._state
+
+        if state == self._SOF_HIGH:
+            if byte == PMS5003_SOF[0]:
+                self._state = self._SOF_LOW
+
+        elif state == self._SOF_LOW:
+            if byte == PMS5003_SOF[1]:
+                frame[0] = PMS5003_SOF[0]
+                frame[1] = byte
+                self._pos = 2
+                self._state = self._LENGTH
+            elif byte != PMS5003_SOF[0]:
+                self._state = self._SOF_HIGH
+
+        elif state == self._LENGTH:
+            frame[self._pos] = byte
+            self._pos += 1
+            if self._pos == 4:
+                frame_length = (frame[2] << 8) | frame[3]
+                if frame_length in (PMS5003Data.DATA_LEN, PMS5003CmdResponse.DATA_LEN):
+                    self._end = 4 + frame_length
+                    self._state = self._BODY
+                else:
+                    self.length_errors += 1
+                    self._state = self._SOF_HIGH
+
+        else:
+            frame[self._pos] = byte
+            self._pos += 1
+            if self._pos == self._end:
+                self._state = self._SOF_HIGH
+                try:
+                    if self._end == PMS5003Data.FRAME_LEN:
+                        response = PMS5003Data(self._data_mv,
+                                               frame_length_bytes=self._length_mv)
+                    else:
+                        response = PMS5003CmdResponse(self._cmd_mv,
+                                                      frame_length_bytes=self._length_mv)
+                except ChecksumMismatchError:
+                    self.checksum_errors += 1
+                    return None
+                self.frames += 1
+                return response
+
+        return None
+
+
 class PMS5003():
     #def __init__(self, baudrate=9600, pin_enable=board.D10, pin_reset=board.D11):
 
     MAX_RESET_TIME = 20.0  # 9.2 seconds seen in testing
     MIN_CMD_INTERVAL = 0.1  # mode changes with interval < 50ms break a PMS5003
+    RESET_PULSE_TIME = 0.1
+
+    # Non-blocking reset states, see start_reset() and update()
+    RESET_IDLE = 0
+    RESET_PULSE = 1
+    RESET_WAIT_FRAME = 2
+    RESET_RESTORE_MODE = 3
+    RESET_SETTLE = 4
 
     @staticmethod
     def _build_cmd_frame(cmd_bytes):
@@ -191,10 +326,28 @@ class PMS5003():
                  pin_enable=board.GP9,
                  mode='active',
                  retries=5,
-                 baudrate=9600
+                 baudrate=9600,
+                 wait_for_reset=True
                  ):
         self._serial = None
+        self._assembler = None
         self._mode = 'active'  # device starts up in active mode
+        self._reset_state = self.RESET_IDLE
+        self._reset_time = 0
+        self.reset_error = None
+        # True after sleep() until wake() or a reset
+        self.sleeping = False
+
+        # Data frames returned by read() and poll(), extra read() attempts and
+        # read requests sent again before a data frame answered the last one,
+        # and the bad frames read() ran into. Frames poll() dropped are counted
+        # by the assembler. How long to wait for a requested frame is up to
+        # the caller, so are timeouts.
+        self.reads = 0
+        self.retries = 0
+        self.checksum_errors = 0
+        self.length_errors = 0
+        self._read_pending = False
 
         self._baudrate = baudrate
         self._pin_enable = pin_enable
@@ -203,9 +356,26 @@ class PMS5003():
         self._reset = None
         self._attempts = retries + 1 if retries else 1
 
+        # Every frame is read into this one buffer. The views are created once
+        # here so the read path does not allocate per frame.
+        self._frame = bytearray(PMS5003Data.FRAME_LEN)
+        self._frame_mv = memoryview(self._frame)
+        # Rest of the header after 0 to 3 bytes of it were read
+        self._header_mvs = tuple(self._frame_mv[have:4] for have in range(4))
+        self._length_mv = self._frame_mv[2:4]
+        self._data_mv = self._frame_mv[4:PMS5003Data.FRAME_LEN]
+        self._cmd_mv = self._frame_mv[4:PMS5003CmdResponse.FRAME_LEN]
+
         if mode not in ('active', 'passive'):
             raise ValueError("Invalid mode")
 
+        # Without waiting, the reset runs in the background through update()
+        # and the requested mode is restored once the device is back up
+        if not wait_for_reset:
+            self._mode = mode
+            self.setup(serial, wait_for_reset=False)
+            return
+
         # Exceptions are caught here as constructor has not
         # raised them in the prior versions
         try:
@@ -225,6 +395,7 @@ class PMS5003():
 
         time.sleep(self.MIN_CMD_INTERVAL)
         self._serial.reset_input_buffer()
+        self._assembler.reset()
         self._serial.write(self._build_cmd_frame(PMS5003_CMD_MODE_PASSIVE))
         # In rare cases a single data frame sneaks in giving FrameLengthError
         try:
@@ -244,6 +415,7 @@ class PMS5003():
         # mode changes with interval < 50ms break on a PMS5003
         time.sleep(self.MIN_CMD_INTERVAL)
         self._serial.reset_input_buffer()
+        self._assembler.reset()
         self._serial.write(self._build_cmd_frame(PMS5003_CMD_MODE_ACTIVE))
         # In rare cases a single data frame sneaks in giving FrameLengthError
         try:
@@ -253,7 +425,7 @@ class PMS5003():
         time.sleep(self.MIN_CMD_INTERVAL)
         return resp
 
-    def setup(self, serial=None):
+    def setup(self, serial=None, wait_for_reset=True):
         if self._pin_enable:
             self._enable = DigitalInOut(self._pin_enable)
             self._enable.direction = Direction.OUTPUT
@@ -270,8 +442,12 @@ class PMS5003():
         self._serial = busio.UART(board.GP16, board.GP17,
                                   baudrate=self._baudrate,
                                   timeout=4) if serial is None else serial
+        self._assembler = PMS5003FrameAssembler(self._serial)
 
-        self.reset()
+        if wait_for_reset:
+            self.reset()
+        else:
+            self.start_reset()
 
     def reset(self):
         """This resets the device via a pin if one is defined.
@@ -282,6 +458,7 @@ class PMS5003():
         time.sleep(0.1)
         self._reset.value = False
         self._serial.reset_input_buffer()
+        self._assembler.reset()
         time.sleep(0.1)
         self._reset.value = True
 
@@ -302,6 +479,75 @@ class PMS5003():
 
         return True
 
+    def start_reset(self):
+        """Starts a reset that runs without blocking. The reset is carried out by
+           calling update() regularly, which also restores passive mode as
+           necessary. Without a reset pin only the mode is restored."""
+        self.reset_error = None
+        self._reset_time = time.monotonic()
+        # The device comes back from a reset awake, without pending requests
+        self.sleeping = False
+        self._read_pending = False
+        if self._reset is None:
+            self._reset_state = self.RESET_RESTORE_MODE
+            return False
+
+        self._reset.value = False
+        self._reset_state = self.RESET_PULSE
+        return True
+
+    @property
+    def resetting(self):
+        """True while a reset started with start_reset() is in progress."""
+        return self._reset_state != self.RESET_IDLE
+
+    def update(self):
+        """Advances a reset started with start_reset(). Each call does at most one
+           short step and never waits. Returns True while the reset is in progress.
+           If the device does not come back, reset_error is set."""
+        state = self._reset_state
+        if state == self.RESET_IDLE:
+            return False
+
+        elapsed = time.monotonic() - self._reset_time
+
+        if state == self.RESET_PULSE:
+            if elapsed >= self.RESET_PULSE_TIME:
+                self._serial.reset_input_buffer()
+                self._assembler.reset()
+                self._reset.value = True
+                self._next_reset_state(self.RESET_WAIT_FRAME)
+
+        elif state == self.RESET_WAIT_FRAME:
+            # Wait for first data frame from the device
+            if self.data_available():
+                self._next_reset_state(self.RESET_RESTORE_MODE)
+            elif elapsed > self.MAX_RESET_TIME:
+                self.reset_error = ReadTimeoutError("PMS5003 Read Timeout: No response after reset")
+                self._reset_state = self.RESET_IDLE
+
+        elif state == self.RESET_RESTORE_MODE:
+            # mode changes with interval < 50ms break on a PMS5003
+            if elapsed >= self.MIN_CMD_INTERVAL:
+                # After a reset device will be in active mode, drop its data
+                # frames and restore passive mode. The command response is
+                # consumed by poll().
+                self._serial.reset_input_buffer()
+                self._assembler.reset()
+                if self._mode == 'passive':
+                    self._serial.write(self._build_cmd_frame(PMS5003_CMD_MODE_PASSIVE))
+                self._next_reset_state(self.RESET_SETTLE)
+
+        elif state == self.RESET_SETTLE:
+            if elapsed >= self.MIN_CMD_INTERVAL:
+                self._reset_state = self.RESET_IDLE
+
+        return self._reset_state != self.RESET_IDLE
+
+    def _next_reset_state(self, state):
+        self._reset_state = state
+        self._reset_time = time.monotonic()
+
     def deinit(self):
         if self._enable is not None:
             self._enable.deinit()
@@ -322,53 +568,137 @@ class PMS5003():
            This will make additional attempts based on retries value in constructor
            if there are exceptions and only raise the first exception if all fail."""
         read_ex = None
-        for _ in range(self._attempts):
+        for attempt in range(self._attempts):
+            if attempt:
+                self.retries += 1
             if self._mode == 'passive':
                 self._cmd_passive_read()
             try:
-                return self._read_data()
+                data = self._read_data()
+                self.reads += 1
+                return data
             except RuntimeError as ex:
+                self._count_error(ex)
                 if read_ex is None:
                     read_ex = ex
         raise read_ex if read_ex else RuntimeError("read failed - internal error")
 
 
+    def _count_error(self, ex):
+        if isinstance(ex, ChecksumMismatchError):
+            self.checksum_errors += 1
+        elif isinstance(ex, FrameLengthError):
+            self.length_errors += 1
+
+    def request_read(self):
+        """Sends a read command in 'passive' mode without waiting for the
+           response. The data frame is collected later by poll().
+           Nothing is sent while a reset is in progress. A request sent while
+           the previous one is still unanswered counts as a retry."""
+        if self._mode == 'passive' and not self.resetting:
+            if self._read_pending:
+                self.retries += 1
+            self._serial.write(self._build_cmd_frame(PMS5003_CMD_READ))
+            self._read_pending = True
+
+    def sleep(self):
+        """Sends the sleep command without waiting, which stops the fan and the laser.
+           The command response is consumed by poll(). Nothing is sent while a
+           reset is in progress, as the reset leaves the device awake."""
+        if self.resetting:
+            return False
+        self._serial.write(self._build_cmd_frame(PMS5003_CMD_SLEEP))
+        self.sleeping = True
+        return True
+
+    def wake(self):
+        """Sends the wakeup command without waiting. The device keeps its mode, but
+           it takes about 30 seconds after waking up for the fan to settle and the
+           readings to be reliable. Frames from before waking up are dropped."""
+        if self.resetting:
+            return False
+        self._serial.reset_input_buffer()
+        self._assembler.reset()
+        self._serial.write(self._build_cmd_frame(PMS5003_CMD_WAKEUP))
+        self.sleeping = False
+        return True
+
+    def poll(self):
+        """Returns the next data frame if a complete one has arrived, otherwise None.
+           This never blocks. Command responses are consumed and not returned.
+           Returns None while a reset is in progress.
+           Do not mix with read() as both consume the same serial data."""
+        if self.resetting:
+            return None
+
+        while True:
+            response = self._assembler.poll()
+            if response is None:
+                return None
+            if isinstance(response, PMS5003Data):
+                self.reads += 1
+                self._read_pending = False
+                return response
+
+    @property
+    def assembler(self):
+        """The frame assembler used by poll(), exposing its frame and error counts."""
+        return self._assembler
+
     def _read_data(self, response_class=PMS5003Data):
-        start = time.monotonic()
+        self._read_header(time.monotonic())
+
+        frame_length = (self._frame[2] << 8) | self._frame[3]
+        response_class.check_data_len(frame_length, desc="Length field")
 
-        sof_index = 0
+        # check_data_len() only lets the two frame lengths through
+        if frame_length == PMS5003Data.DATA_LEN:
+            raw_data = self._data_mv
+        else:
+            raw_data = self._cmd_mv
+
+        read_len = self._serial.readinto(raw_data)
+        if read_len is None or read_len != frame_length:
+            read_len = "TIMEOUT" if read_len is None else read_len
+            raise SerialTimeoutError("PMS5003 Read Timeout: Invalid frame length. "
+                                     "Got {} bytes, expected {}.".format(read_len,
+                                                                         frame_length))
+
+        return response_class(raw_data, frame_length_bytes=self._length_mv)
+
+    def _read_header(self, start):
+        """
+        Fill the first 4 bytes of the frame buffer with the start of frame and
+        the frame length field. Bytes are read in bulk and any leading bytes
+        that are not part of a start of frame are shifted out in place.
+        """
+        frame = self._frame
+        have = 0
 
         while True:
             elapsed = time.monotonic() - start
             if elapsed > 5:
                 raise ReadTimeoutError("PMS5003 Read Timeout: Could not find start of frame")
 
-            one_byte = self._serial.read(1)
-            if one_byte is None or len(one_byte) == 0:
+            read_len = self._serial.readinto(self._header_mvs[have])
+            if not read_len:
                 raise SerialTimeoutError("PMS5003 Read Timeout: Failed to read start of frame byte")
+            have += read_len
 
-            if ord(one_byte) == PMS5003_SOF[sof_index]:
-                if sof_index == 0:
-                    sof_index = 1
-                elif sof_index == 1:
+            skip = 0
+            while skip < have:
+                if frame[skip] == PMS5003_SOF[0] and (skip + 1 == have
+                                                      or frame[skip + 1] == PMS5003_SOF[1]):
                     break
-            else:
-                sof_index = 0
-
-        len_data = self._serial.read(2)  # Get frame length packet
-        if len_data is None or len(len_data) != 2:
-            raise SerialTimeoutError("PMS5003 Read Timeout: Could not find length packet")
-        frame_length = struct.unpack(">H", len_data)[0]
-        response_class.check_data_len(frame_length, desc="Length field")
+                skip += 1
 
-        raw_data = self._serial.read(frame_length)
-        if raw_data is None or len(raw_data) != frame_length:
-            read_len = "TIMEOUT" if raw_data is None else len(raw_data)
-            raise SerialTimeoutError("PMS5003 Read Timeout: Invalid frame length. "
-                                     "Got {} bytes, expected {}.".format(read_len,
-                                                                         frame_length))
+            if skip:
+                have -= skip
+                for i in range(have):
+                    frame[i] = frame[i + skip]
 
-        return response_class(raw_data, frame_length_bytes=len_data)
+            if have == 4:
+                return
 
     def _cmd_passive_read(self):
         """
@@ -0,0 +1,53 @@
+# The AQI lookup tables of dphacks_usaqi must give the same AQI as the EPA
+# piecewise-linear formula for every concentration.
+#
+#   pytest tests
+#
+# Not python3 -m pytest, that puts code.py first on the path where it hides
+# the standard library's code module.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import dphacks_usaqi as USAQI
+
+# Past the top breakpoints, where the formula is extrapolated
+PM25_MAX = 1000.0
+PM100_MAX = 1000
+
+
+def mismatches(function, formula, values):
+    return [(value, function(value), formula(value)) for value in values
+            if function(value) != formula(value)]
+
+def test_pm25_tenths():
+    values = [tenths / 10 for tenths in range(int(PM25_MAX * 10) + 1)]
+    assert mismatches(USAQI.pm25_aqi, USAQI._pm25_formula, values) == []
+
+def test_pm25_hundredths():
+    # Truncated to tenths, these must land in the same table entry
+    values = [hundredths / 100 for hundredths in range(int(PM25_MAX * 100) + 1)]
+    assert mismatches(USAQI.pm25_aqi, USAQI._pm25_formula, values) == []
+
+def test_pm25_integers():
+    values = list(range(int(PM25_MAX) + 1))
+    assert mismatches(USAQI.pm25_aqi, USAQI._pm25_formula, values) == []
+
+def test_pm100_integers():
+    values = list(range(PM100_MAX + 1))
+    assert mismatches(USAQI.pm100_aqi, USAQI._pm100_formula, values) == []
+
+def test_pm100_fractions():
+    values = [tenths / 10 for tenths in range(PM100_MAX * 10 + 1)]
+    assert mismatches(USAQI.pm100_aqi, USAQI._pm100_formula, values) == []
+
+def test_breakpoints():
+    # Both ends of every breakpoint range give the ends of its AQI range
+    for (low, high), (aqi_low, aqi_high) in zip(USAQI.PM25, USAQI.AQI):
+        assert USAQI.pm25_aqi(low) == aqi_low
+        assert USAQI.pm25_aqi(high) == aqi_high
+    for (low, high), (aqi_low, aqi_high) in zip(USAQI.PM100, USAQI.AQI):
+        assert USAQI.pm100_aqi(low) == aqi_low
+        assert USAQI.pm100_aqi(high) == aqi_high
@@ -0,0 +1,337 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Collect the MQTT messages of many boards into one SQLite database. Runs on a
+# computer next to the broker, with Python 3.9+ and aiomqtt:
+#
+#   pip install aiomqtt
+#   python3 tools/aggregator.py --host broker.local --topic 'enviro/#' --db fleet.db
+#
+# Every board publishes to its own MQTT_TOPIC. All the payloads the firmware
+# sends are understood: single JSON measurements, JSON and binary batches and,
+# with MQTT_DEADBAND, single fields on MQTT_TOPIC/<field>. The board is
+# identified by its MQTT_TOPIC.
+#
+# Measurements go to the measurements table, one row per measurement with a
+# column per field, and boards to the devices table:
+#
+#   SELECT time, pm25_env FROM measurements JOIN devices ON devices.id = device
+#   WHERE topic = 'enviro/kitchen' ORDER BY time
+#
+# time is when the aggregator received the measurement, in seconds since 1970.
+# The boards don't set their clock, so rows of a batch are placed before the
+# time it was received by their distance to its last row, and the timestamps
+# of the board are kept in device_time.
+#
+# Incoming messages wait in a bounded queue, rows are written in a separate
+# thread, FLUSH_SIZE rows or FLUSH_INTERVAL seconds at a time, in one
+# transaction with executemany. When writing falls behind, reading from the
+# broker waits, and once the queue is full new messages are dropped and counted.
+
+import os
+import sys
+import ssl
+import json
+import time
+import signal
+import sqlite3
+import asyncio
+import argparse
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import dphacks_payload as PAYLOAD
+
+# Fields stored, everything numeric the firmware publishes
+STORE_FIELDS = PAYLOAD.COLUMNS
+STORE_COLUMNS = tuple(name.replace(' ', '_') for name in STORE_FIELDS)
+# Last topic levels of the single field messages of MQTT_DEADBAND, the AQI
+# category texts are published too but not stored
+FIELD_TOPICS = set(STORE_COLUMNS) | {'category', 'color', 'rgb'}
+
+# Errors of a message that can't be decoded
+DECODE_ERRORS = (ValueError, KeyError, IndexError, TypeError, OverflowError)
+
+
+def split_topic(topic):
+    """
+    Returns the board topic and the field of a message topic, the field is
+    None unless it is a single field message
+    """
+    device, _, last = topic.rpartition('/')
+    if device and last in FIELD_TOPICS:
+        return device, last.replace('_', ' ')
+    return topic, None
+
+def measurement(device, received, device_time, values):
+    """
+    Returns a row for the measurements table, None if it has nothing to store
+    """
+    row = [device, received, device_time]
+    stored = False
+    for name in STORE_FIELDS:
+        value = values.get(name)
+        if type(value) not in (int, float):
+            value = None
+        else:
+            stored = True
+        row.append(value)
+    return tuple(row) if stored else None
+
+def decode_message(topic, payload, received):
+    """
+    Returns the rows of an MQTT message
+    """
+    device, field = split_topic(topic)
+    if field is not None:
+        rows = [(None, {field: json.loads(payload)})]
+    else:
+        rows = PAYLOAD.decode(payload)
+
+    last = rows[-1][0]
+    decoded = []
+    for device_time, values in rows:
+        when = received if device_time is None else received - (last - device_time)
+        row = measurement(device, when, device_time, values)
+        if row is not None:
+            decoded.append(row)
+    return decoded
+
+
+class Store:
+    """
+    The SQLite database. Only used from the writer thread.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS devices ("
+                        "id INTEGER PRIMARY KEY, topic TEXT UNIQUE NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS measurements ("
+                        "device INTEGER NOT NULL REFERENCES devices(id), "
+                        "time REAL NOT NULL, device_time INTEGER, "
+                        + ", ".join(name + " REAL" for name in STORE_COLUMNS) + ")")
+        self.db.execute("CREATE INDEX IF NOT EXISTS measurements_device_time "
+                        "ON measurements (device, time)")
+        self.devices = dict(self.db.execute("SELECT topic, id FROM devices"))
+        self.insert = "INSERT INTO measurements VALUES ({})".format(
+            ", ".join("?" * (3 + len(STORE_COLUMNS))))
+
+    def device(self, topic):
+        """
+        Returns the id of a board, adding it the first time it is seen
+        """
+        device = self.devices.get(topic)
+        if device is None:
+            device = self.db.execute("INSERT INTO devices (topic) VALUES (?)", (topic,)).lastrowid
+            self.devices[topic] = device
+        return device
+
+    def write(self, rows):
+        """
+        Insert rows in one transaction
+        """
+        device = self.device
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(self.insert, [(device(row[0]),) + row[1:] for row in rows])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.db.close()
+
+
+class CountingQueue(asyncio.Queue):
+    """
+    Queue of the incoming MQTT messages that drops and counts the ones it has
+    no room for, instead of logging each one
+    """
+    dropped = 0
+
+    def put_nowait(self, item):
+        try:
+            super().put_nowait(item)
+        except asyncio.QueueFull:
+            CountingQueue.dropped += 1
+
+
+class Aggregator:
+    """
+    Decodes the messages and hands the rows to the writer thread in batches
+    """
+
+    def __init__(self, store, flush_size, flush_interval, pending):
+        self.store = store
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rows = []
+        # Batches waiting for the writer, reading stops while it is full
+        self.batches = asyncio.Queue(maxsize=pending)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        self.received = 0
+        self.errors = 0
+        self.written = 0
+
+    async def add(self, topic, payload, received):
+        self.received += 1
+        try:
+            self.rows.extend(decode_message(topic, payload, received))
+        except DECODE_ERRORS as e:
+            self.errors += 1
+            if self.errors <= 10:
+                print("Could not decode a message on {}: {!r}".format(topic, e))
+            return
+        if len(self.rows) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.rows:
+            rows, self.rows = self.rows, []
+            await self.batches.put(rows)
+
+    async def flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = await self.batches.get()
+            try:
+                await loop.run_in_executor(self.executor, self.store.write, rows)
+                self.written += len(rows)
+            except sqlite3.Error as e:
+                print("Could not write {} rows: {}".format(len(rows), e))
+            finally:
+                self.batches.task_done()
+
+    async def receive(self, args):
+        """
+        Read the messages from the broker, reconnecting when the connection is lost
+        """
+        import aiomqtt
+
+        tls = ssl.create_default_context() if args.tls else None
+        delay = 1
+        while True:
+            try:
+                async with aiomqtt.Client(args.host, args.port,
+                                          username=args.username, password=args.password,
+                                          identifier=args.client_id, tls_context=tls,
+                                          queue_type=CountingQueue,
+                                          max_queued_incoming_messages=args.queue) as client:
+                    await client.subscribe([(topic, args.qos) for topic in args.topic])
+                    print("Connected to {}:{}, subscribed to {}".format(args.host, args.port,
+                                                                      ", ".join(args.topic)))
+                    delay = 1
+                    async for message in client.messages:
+                        await self.add(str(message.topic), message.payload, time.time())
+            except aiomqtt.MqttError as e:
+                print("MQTT connection lost: {}, reconnecting in {}s".format(e, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def report(self, period):
+        """
+        Print the message and row rates every period seconds
+        """
+        received = written = 0
+        while True:
+            await asyncio.sleep(period)
+            print("{:.0f} messages/s, {:.0f} rows/s written, {} waiting, {} dropped, {} not decoded".format(
+                (self.received - received) / period, (self.written - written) / period,
+                len(self.rows) + self.batches.qsize() * self.flush_size,
+                CountingQueue.dropped, self.errors))
+            received, written = self.received, self.written
+
+    async def close(self):
+        """
+        Write what is still waiting
+        """
+        await self.flush()
+        await self.batches.join()
+        self.executor.shutdown()
+
+
+async def run(args):
+    aggregator = Aggregator(Store(args.db), args.flush_size, args.flush_interval, args.pending)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    writer = asyncio.create_task(aggregator.writer())
+    tasks = [asyncio.create_task(aggregator.receive(args)),
+             asyncio.create_task(aggregator.flusher())]
+    if args.stats:
+        tasks.append(asyncio.create_task(aggregator.report(args.stats)))
+
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await aggregator.close()
+    writer.cancel()
+    aggregator.store.close()
+    print("Received {} messages, wrote {} rows".format(aggregator.received, aggregator.written))
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect Pico W Air MQTT messages into SQLite")
+    parser.add_argument('--host', default='127.0.0.1', help="MQTT broker")
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--tls', action='store_true', help="connect with TLS")
+    parser.add_argument('--client-id', help="MQTT client id, random if not set")
+    parser.add_argument('--topic', action='append',
+                        help="topic filter to subscribe to, can be repeated, default enviro/#")
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--db', default='fleet.db', help="SQLite database file")
+    parser.add_argument('--flush-size', type=int, default=5000, help="rows per transaction")
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help="seconds before waiting rows are written anyway")
+    parser.add_argument('--queue', type=int, default=20000,
+                        help="incoming messages kept while decoding falls behind")
+    parser.add_argument('--pending', type=int, default=4,
+                        help="batches of rows kept while writing falls behind")
+    parser.add_argument('--stats', type=float, default=10, help="seconds between reports, 0 for none")
+    args = parser.parse_args()
+    if not args.topic:
+        args.topic = ['enviro/#']
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Benchmarks of the hot paths of the firmware, run on a computer with CPython:
+# the PMS5003 driver fed by an in-memory UART, the AQI calculation, smoothing
+# and a whole measurement from sensor frames to the JSON message. For every
+# benchmark it reports operations per second, the latency of single calls and
+# the memory a call allocates, measured with tracemalloc.
+#
+# The numbers are only comparable between runs on the same computer. Save them
+# before a change and compare after it, a slower or more allocating benchmark
+# is reported and makes the exit status 1:
+#
+#   python3 tools/benchmark.py -o before.json
+#   python3 tools/benchmark.py -o after.json --compare before.json
+#   python3 tools/benchmark.py -k usaqi --seconds 0.5
+
+import os
+import sys
+import gc
+import json
+import time
+import array
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'lib'))
+# The PMS5003 driver imports the hardware modules, the simulator has them
+sys.path.insert(0, os.path.join(TOOLS, 'hostsim'))
+
+import dphacks_usaqi as USAQI
+import dphacks_sample as SAMPLE
+from dphacks_sample import Sample
+from dphacks_smooth import Smoother
+from pms5003 import PMS5003, PMS5003Data, PMS5003FrameAssembler
+from pms5003sim import Air, data_frame
+
+# Frames per measurement in the pipeline benchmark, the sensor sends about
+# one a second and INTERVAL is 5 seconds in settings.toml
+FRAMES_PER_SAMPLE = 5
+SMOOTH = 5
+SEED = 1
+
+
+class ReplayUART:
+    """
+    busio.UART stand-in that replays the same bytes over and over, so reads
+    never wait. in_waiting always reports `waiting` bytes.
+    """
+
+    def __init__(self, data, waiting=64):
+        self._data = bytes(data)
+        self._pos = 0
+        self.in_waiting = waiting
+
+    def readinto(self, buffer):
+        data = self._data
+        size = len(buffer)
+        done = 0
+        while done < size:
+            count = min(size - done, len(data) - self._pos)
+            buffer[done:done + count] = data[self._pos:self._pos + count]
+            done += count
+            self._pos = (self._pos + count) % len(data)
+        return size
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def deinit(self):
+        pass
+
+
+def sensor_frames(count=50):
+    """
+    Returns count PMS5003 data frames of simulated air, back to back
+    """
+    air = Air(rng=random.Random(SEED))
+    return b''.join(data_frame(air.values()) for _ in range(count))
+
+def concentrations(count=1000, high=250):
+    """
+    Returns an endless iterator of concentrations as the firmware has them,
+    floats from the float32 arrays of the sample records
+    """
+    rng = random.Random(SEED)
+    values = array.array('f', (rng.uniform(0, high) for _ in range(count)))
+    values = list(values)
+
+    def forever():
+        while True:
+            yield from values
+    return forever()
+
+
+### BENCHMARKS ###
+# Each one returns the function that is timed, every call is one operation
+
+def bench_read_data():
+    """
+    PMS5003._read_data, the blocking read of one data frame
+    """
+    sensor = PMS5003(serial=ReplayUART(sensor_frames()), wait_for_reset=False)
+    return sensor._read_data
+
+def bench_data_response():
+    """
+    PMS5003Data.__init__, unpacking and checksumming a frame in place
+    """
+    frame = memoryview(bytearray(data_frame(Air(rng=random.Random(SEED)).values())))
+    data = frame[4:]
+    length = frame[2:4]
+    return lambda: PMS5003Data(data, frame_length_bytes=length)
+
+def bench_assembler_poll():
+    """
+    PMS5003FrameAssembler.poll, the non-blocking frame assembly
+    """
+    return PMS5003FrameAssembler(ReplayUART(sensor_frames())).poll
+
+def bench_truncate():
+    values = concentrations()
+    return lambda: USAQI.truncate(next(values), 1)
+
+def bench_pm25_formula():
+    values = concentrations()
+    return lambda: USAQI._pm25_formula(next(values))
+
+def bench_pm25_aqi():
+    USAQI.build_tables()
+    values = concentrations()
+    return lambda: USAQI.pm25_aqi(next(values))
+
+def bench_pm100_aqi():
+    USAQI.build_tables()
+    values = concentrations(high=500)
+    return lambda: USAQI.pm100_aqi(next(values))
+
+def bench_aqi_info():
+    aqis = iter(range(0, 500))
+    return lambda: USAQI.aqi_info(next(aqis, 250))
+
+def bench_smooth():
+    """
+    average_sample and average_values of code.py: add a sample and average
+    """
+    store = Smoother(SMOOTH, SAMPLE.NUM_FIELDS, SAMPLE.SCALES)
+    sample = Sample()
+    averaged = Sample()
+    values = concentrations()
+
+    def run():
+        for field in range(SAMPLE.NUM_FIELDS):
+            sample.set(field, next(values))
+        store.add(sample)
+        store.average_into(averaged)
+    return run
+
+def bench_to_dict():
+    sample = Sample()
+    values = concentrations()
+    for field in range(SAMPLE.NUM_FIELDS):
+        sample.set(field, next(values))
+    return sample.to_dict
+
+def bench_pipeline():
+    """
+    One measurement as measure() in code.py does it: collect the frames of an
+    interval, average them, smooth, add the AQI and serialize to JSON
+    """
+    USAQI.build_tables()
+    sensor = PMS5003(serial=ReplayUART(sensor_frames()), wait_for_reset=False)
+    sensor._reset_state = PMS5003.RESET_IDLE
+    store = Smoother(SMOOTH, SAMPLE.NUM_FIELDS, SAMPLE.SCALES)
+    sample = Sample()
+    averaged = Sample()
+    sums = array.array('L', [0] * SAMPLE.PM_COUNT)
+
+    def run():
+        frames = 0
+        while frames < FRAMES_PER_SAMPLE:
+            data = sensor.poll().data
+            for i in range(SAMPLE.PM_COUNT):
+                sums[i] += data[i]
+            frames += 1
+        for i in range(SAMPLE.PM_COUNT):
+            sample.set(i, sums[i] / frames)
+            sums[i] = 0
+        sample.set(SAMPLE.TEMPERATURE, 21.5)
+        sample.set(SAMPLE.HUMIDITY, 45.0)
+
+        store.add(sample)
+        store.average_into(averaged)
+        message = averaged.to_dict()
+        values = averaged.values
+        overall, pm25_index, pm100_index = USAQI.pm_aqi(round(values[SAMPLE.PM25_ENV]),
+                                                        round(values[SAMPLE.PM100_ENV]))
+        aqi = USAQI.aqi_info(overall)
+        aqi['aqi pm25'] = pm25_index
+        aqi['aqi pm100'] = pm100_index
+        message.update(aqi)
+        return json.dumps(message)
+    return run
+
+BENCHMARKS = (
+    ('pms5003.read_data', bench_read_data),
+    ('pms5003.data_response', bench_data_response),
+    ('pms5003.assembler_poll', bench_assembler_poll),
+    ('usaqi.truncate', bench_truncate),
+    ('usaqi.pm25_formula', bench_pm25_formula),
+    ('usaqi.pm25_aqi', bench_pm25_aqi),
+    ('usaqi.pm100_aqi', bench_pm100_aqi),
+    ('usaqi.aqi_info', bench_aqi_info),
+    ('smooth.add_average', bench_smooth),
+    ('sample.to_dict', bench_to_dict),
+    ('pipeline.sample_to_json', bench_pipeline),
+)
+
+
+### MEASURING ###
+
+def _batch(operation, number):
+    """
+    Returns the seconds number calls take
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        operation()
+    return time.perf_counter() - start
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def measure(operation, seconds, calls):
+    """
+    Returns the throughput, latency and allocations of operation
+    """
+    # Batches of about 10 ms keep the timer out of the throughput
+    number = 1
+    while _batch(operation, number) < 0.01:
+        number *= 2
+
+    # The fastest batch is the one least disturbed by the rest of the system
+    rates = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end or len(rates) < 3:
+        rates.append(number / _batch(operation, number))
+
+    clock = time.perf_counter_ns
+    latencies = []
+    for _ in range(calls):
+        start = clock()
+        operation()
+        latencies.append(clock() - start)
+    latencies.sort()
+
+    # Peak is what a call allocates while it runs, retained what it leaves behind
+    gc.collect()
+    tracemalloc.start()
+    first = tracemalloc.get_traced_memory()[0]
+    peak_total = 0
+    alloc_calls = min(calls, 1000)
+    for _ in range(alloc_calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        operation()
+        peak_total += tracemalloc.get_traced_memory()[1] - before
+    retained = tracemalloc.get_traced_memory()[0] - first
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': round(max(rates), 1),
+        'p50_us': round(percentile(latencies, 50) / 1000, 3),
+        'p90_us': round(percentile(latencies, 90) / 1000, 3),
+        'p99_us': round(percentile(latencies, 99) / 1000, 3),
+        'max_us': round(latencies[-1] / 1000, 3),
+        'peak_bytes': round(peak_total / alloc_calls, 1),
+        'retained_bytes': round(retained / alloc_calls, 1),
+    }
+
+def commit():
+    """
+    Returns the git commit of the firmware, or None
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=TOOLS,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(selected, seconds, calls):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = measure(setup(), seconds, calls)
+        print_result(name, results[name])
+    return {
+        'commit': commit(),
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def print_result(name, result):
+    print("{:26} {:>12,.0f} ops/s  p50 {:8.2f} us  p99 {:8.2f} us  {:8.1f} B peak  {:6.1f} B kept".format(
+        name, result['ops_per_sec'], result['p50_us'], result['p99_us'],
+        result['peak_bytes'], result['retained_bytes']))
+
+def compare(baseline, current, threshold):
+    """
+    Print the change of every benchmark against the baseline. Returns the
+    names of the benchmarks that got slower by more than threshold percent
+    or allocate more.
+    """
+    regressions = []
+    print("\ncompared to {} ({})".format(baseline.get('commit'), baseline.get('time')))
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print("{:26} new".format(name))
+            continue
+        speed = (result['ops_per_sec'] / old['ops_per_sec'] - 1) * 100
+        latency = (result['p50_us'] / old['p50_us'] - 1) * 100 if old['p50_us'] else 0.0
+        memory = result['peak_bytes'] - old['peak_bytes']
+        # Small differences in the tracemalloc numbers are noise
+        worse = speed < -threshold or memory > max(16, old['peak_bytes'] * threshold / 100)
+        if worse:
+            regressions.append(name)
+        print("{:26} {:+7.1f}% ops/s  {:+7.1f}% p50  {:+8.1f} B peak{}".format(
+            name, speed, latency, memory, "  REGRESSION" if worse else ""))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Pico W Air hot paths")
+    parser.add_argument('-k', dest='select', action='append', default=[],
+                        help="only run benchmarks with this in their name")
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help="time spent measuring the throughput of each benchmark")
+    parser.add_argument('--calls', type=int, default=10000,
+                        help="calls timed one by one for the latency percentiles")
+    parser.add_argument('-o', '--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare with results saved before")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="slowdown in percent reported as a regression")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, setup in BENCHMARKS:
+            print(name)
+        return 0
+
+    current = run(args.select, args.seconds, args.calls)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
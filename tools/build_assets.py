@@ -0,0 +1,72 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Write a gzip copy next to every file of the web server, index.html.gz next to
+# index.html. The board sends the copy to browsers that accept gzip, as long
+# as it is not older than its source. Runs on a computer, copy the .gz files to
+# the html folder of the CIRCUITPY drive after the files they were built from.
+#
+#   python3 tools/build_assets.py
+#   python3 tools/build_assets.py /Volumes/CIRCUITPY/html
+
+import os
+import sys
+import gzip
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from dphacks_assets import GZIP_SUFFIX
+
+
+def build(path):
+    """
+    Write the gzip copy of a file, returns its size
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    # mtime=0 keeps the output, and so the ETag, the same between builds
+    packed = gzip.compress(data, 9, mtime=0)
+    with open(path + GZIP_SUFFIX, 'wb') as f:
+        f.write(packed)
+    print("{}: {} -> {} bytes".format(path, len(data), len(packed)))
+    return len(packed)
+
+def main():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'html')
+    parser = argparse.ArgumentParser(description="Build the gzip copies of the Pico W Air web files")
+    parser.add_argument('root', nargs='?', default=default, help="folder with the web files")
+    args = parser.parse_args()
+
+    for name in sorted(os.listdir(args.root)):
+        path = os.path.join(args.root, name)
+        if name.endswith(GZIP_SUFFIX) or not os.path.isfile(path):
+            continue
+        build(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Decode the sample log written by the board into CSV. Runs on a computer.
+#
+#   python3 tools/decode_log.py /Volumes/CIRCUITPY/log/samples.bin.1 /Volumes/CIRCUITPY/log/samples.bin
+#   python3 tools/decode_log.py --url http://192.168.1.50 --since 1700000000
+
+import os
+import sys
+import csv
+import argparse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import dphacks_log as LOG
+from dphacks_sample import FIELDS
+
+
+def stream_records(stream, since):
+    """
+    Generate the records of a log streamed by the /log route
+    """
+    block = bytearray(LOG.BLOCK_SIZE)
+    while True:
+        # HTTP responses can come in pieces smaller than a block
+        view = memoryview(block)
+        got = 0
+        while got < LOG.BLOCK_SIZE:
+            n = stream.readinto(view[got:])
+            if not n:
+                return
+            got += n
+        yield from LOG.decode_block(block, since)
+
+def write_rows(writer, records):
+    """
+    Write records as CSV rows, leaving out values that weren't measured
+    """
+    for timestamp, valid, values in records:
+        row = [timestamp]
+        for field, value in enumerate(values):
+            if valid & (1 << field):
+                row.append(round(value, 2))
+            else:
+                row.append('')
+        writer.writerow(row)
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode the Pico W Air sample log to CSV")
+    parser.add_argument('files', nargs='*', help="log files, oldest first (samples.bin.1 then samples.bin)")
+    parser.add_argument('--url', help="read the log from the board's /log route, e.g. http://192.168.1.50")
+    parser.add_argument('--since', type=int, default=0, help="leave out records before this time (seconds)")
+    args = parser.parse_args()
+
+    if not args.files and not args.url:
+        parser.error("give log files or --url")
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['time'] + list(FIELDS))
+
+    if args.url:
+        url = '{}/log?since={}'.format(args.url.rstrip('/'), args.since)
+        with urllib.request.urlopen(url) as response:
+            write_rows(writer, stream_records(response, args.since))
+        return
+
+    for path in args.files:
+        with open(path, 'rb') as f:
+            write_rows(writer, LOG.read_file(f, args.since))
+
+if __name__ == '__main__':
+    main()
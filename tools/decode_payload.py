@@ -0,0 +1,64 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Decode MQTT payloads published by the board, single measurements and JSON or
+# binary batches, into one JSON object per measurement. Runs on a computer.
+#
+#   mosquitto_sub -h example.local -t enviro/picoair -C 1 | python3 tools/decode_payload.py
+#   python3 tools/decode_payload.py message1.bin message2.bin
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import dphacks_payload as PAYLOAD
+
+
+def print_rows(payload):
+    """
+    Print the measurements of a payload, with their timestamp when it has one
+    """
+    for timestamp, values in PAYLOAD.decode(payload):
+        if timestamp is not None:
+            values = dict(values, time=timestamp)
+        print(json.dumps(values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode Pico W Air MQTT payloads")
+    parser.add_argument('files', nargs='*', help="files with one payload each, standard input if none")
+    args = parser.parse_args()
+
+    if not args.files:
+        print_rows(sys.stdin.buffer.read())
+    for path in args.files:
+        with open(path, 'rb') as f:
+            print_rows(f.read())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Host simulator stand-in for the AHT20 driver. Temperature and humidity drift
+# slowly around a room climate.
+
+import random
+
+
+class AHTx0:
+    def __init__(self, i2c_bus, address=0x38):
+        self._rng = random.Random()
+        self._temperature = 21.5
+        self._humidity = 45.0
+
+    @property
+    def temperature(self):
+        self._temperature += (21.5 - self._temperature) * 0.01 + self._rng.gauss(0, 0.05)
+        return self._temperature
+
+    @property
+    def relative_humidity(self):
+        self._humidity += (45.0 - self._humidity) * 0.01 + self._rng.gauss(0, 0.2)
+        return min(100.0, max(0.0, self._humidity))
@@ -0,0 +1,65 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Host simulator stand-in for the CircuitPython busio module. Every UART is a
+# simulated PMS5003 wired to the reset and enable pins of the Pico W Air
+# board, and I2C finds the simulated AHT20. run.py sets the options below.
+
+import board
+import digitalio
+from pms5003sim import SimulatedPMS5003
+
+# Frame schedule and random seed of the simulated PMS5003, see pms5003sim
+PMS5003_SCHEDULE = 'ok'
+PMS5003_SEED = None
+# PM 2.5 level the simulated air wanders around
+PMS5003_LEVEL = 12.0
+# When False no I2C sensor is connected
+I2C_SENSORS = True
+
+PMS5003_RESET = board.GP8
+PMS5003_ENABLE = board.GP9
+
+
+class UART(SimulatedPMS5003):
+    def __init__(self, tx=None, rx=None, *, baudrate=9600, timeout=1, **kwargs):
+        super().__init__(PMS5003_SCHEDULE, PMS5003_SEED, PMS5003_LEVEL, timeout)
+        self.baudrate = baudrate
+        digitalio.watch(PMS5003_RESET, self.set_reset)
+        digitalio.watch(PMS5003_ENABLE, self.set_enable)
+
+    def deinit(self):
+        digitalio.unwatch(PMS5003_RESET, self.set_reset)
+        digitalio.unwatch(PMS5003_ENABLE, self.set_enable)
+
+
+class I2C:
+    def __init__(self, scl, sda, *, frequency=100000):
+        if not I2C_SENSORS:
+            raise RuntimeError("No pull up found on SDA or SCL; check your wiring")
+
+    def deinit(self):
+        pass
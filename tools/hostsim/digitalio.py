@@ -0,0 +1,105 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Host simulator stand-in for the CircuitPython digitalio module. Outputs only
+# keep their value, the simulated sensors watch their control pins and the
+# LEDs can be traced on the console.
+
+import time
+
+# Print every change of an output when set, see run.py --leds
+TRACE = False
+
+# DigitalInOut of every pin in use, by pin name
+PINS = {}
+_watchers = {}
+
+
+def watch(pin, callback):
+    """
+    Call callback(value) whenever the output on pin changes
+    """
+    _watchers.setdefault(pin.name, []).append(callback)
+
+def unwatch(pin, callback):
+    callbacks = _watchers.get(pin.name, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+
+
+class Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+
+class Pull:
+    UP = 1
+    DOWN = 2
+
+
+class DriveMode:
+    PUSH_PULL = 0
+    OPEN_DRAIN = 1
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self._value = False
+        PINS[pin.name] = self
+
+    @property
+    def value(self):
+        if self.direction == Direction.OUTPUT:
+            return self._value
+        if self.pin.grounded:
+            return False
+        return self.pull == Pull.UP
+
+    @value.setter
+    def value(self, value):
+        value = bool(value)
+        if value == self._value:
+            return
+        self._value = value
+        if TRACE:
+            print('[{:.2f}] {} {}'.format(time.monotonic(), self.pin.name, 'on' if value else 'off'))
+        for callback in _watchers.get(self.pin.name, ()):
+            callback(value)
+
+    def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        self.direction = Direction.OUTPUT
+        self.value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def deinit(self):
+        if PINS.get(self.pin.name) is self:
+            del PINS[self.pin.name]
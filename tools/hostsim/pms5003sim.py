@@ -0,0 +1,296 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Simulated PMS5003 for the host simulator, it stands in for the UART the
+# sensor is connected to. Data frames follow a schedule of valid and corrupted
+# frames, so the driver's error handling runs the same way every time.
+#
+# A schedule is a comma separated list of frame kinds, each optionally
+# repeated with *count, and it starts over when it reaches the end:
+#
+#   ok*20,checksum,ok*10,noise,ok*10,silent*15
+#
+#   ok          valid data frame
+#   checksum    data frame with a wrong checksum
+#   length      data frame with an invalid length field
+#   truncated   only the first half of a data frame
+#   noise       random bytes followed by a valid data frame
+#   silent      no frame at all, the slot is skipped
+
+import time
+import random
+import struct
+
+SOF = b'BM'
+
+OK = 'ok'
+CHECKSUM = 'checksum'
+LENGTH = 'length'
+TRUNCATED = 'truncated'
+NOISE = 'noise'
+SILENT = 'silent'
+KINDS = (OK, CHECKSUM, LENGTH, TRUNCATED, NOISE, SILENT)
+
+CMD_MODE = 0xe1
+CMD_READ = 0xe2
+CMD_SLEEP = 0xe4
+
+
+def parse_schedule(spec):
+    """
+    Returns the list of frame kinds of a schedule like "ok*20,checksum"
+    """
+    schedule = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        kind, _, count = entry.partition('*')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("Unknown PMS5003 frame kind: " + kind)
+        schedule.extend([kind] * (int(count) if count else 1))
+    if not schedule:
+        raise ValueError("The PMS5003 schedule is empty")
+    return schedule
+
+def frame(payload, length=None):
+    """
+    Returns a frame with start bytes, length field and checksum around payload
+    """
+    head = SOF + struct.pack('>H', len(payload) + 2 if length is None else length) + payload
+    return head + struct.pack('>H', sum(head) & 0xffff)
+
+def data_frame(values):
+    """
+    Returns a data frame for the 12 measurements of a PMS5003, in frame order:
+    PM 1, 2.5 and 10 standard, PM 1, 2.5 and 10 environmental and the particle
+    counts from 0.3 to 10 um
+    """
+    return frame(struct.pack('>13H', *values, 0))
+
+
+class Air:
+    """
+    Particle concentrations that wander around a level, with a short spike now
+    and then, like a room where someone is cooking once in a while.
+    """
+
+    def __init__(self, level=12.0, rng=None):
+        self.level = level
+        self.pm25 = level
+        self._spike = 0.0
+        self._rng = rng or random.Random()
+
+    def values(self, warmup=0.0):
+        """
+        Returns the 12 values of the next data frame. warmup from 1 down to 0
+        makes the readings overshoot like a fan that has just started.
+        """
+        rng = self._rng
+        self.pm25 += (self.level - self.pm25) * 0.05 + rng.gauss(0, self.level * 0.05)
+        self.pm25 = max(0.0, self.pm25)
+        if self._spike < 1 and rng.random() < 0.002:
+            self._spike = rng.uniform(5, 15) * self.level
+        self._spike *= 0.9
+
+        pm25 = (self.pm25 + self._spike) * (1 + warmup)
+        pm1 = pm25 * 0.7
+        pm10 = pm25 * 1.3
+        # Above 30 ug/m3 the standard particle values are higher than the
+        # environmental ones on a real sensor
+        factor = 1.5 if pm25 > 30 else 1.0
+        counts = [pm25 * 180, pm25 * 55, pm25 * 10, pm25 * 1.2, pm25 * 0.3, pm25 * 0.1]
+        values = [pm1 * factor, pm25 * factor, pm10 * factor, pm1, pm25, pm10] + counts
+        return [min(0xffff, int(v + 0.5)) for v in values]
+
+
+class SimulatedPMS5003:
+    """
+    A PMS5003 on the other side of a UART, with the busio.UART methods the
+    driver uses. In active mode it sends a data frame every FRAME_PERIOD
+    seconds, in passive mode one for every read command. It answers the mode
+    and sleep commands and stops while it sleeps or is held in reset.
+    """
+
+    # The real sensor sends every 0.2 to 2.3 seconds depending on the air
+    FRAME_PERIOD = 1.0
+    # Time from a reset or wake up to the first frame
+    STARTUP_TIME = 2.5
+    # Readings are off for this long after the fan starts
+    WARMUP_TIME = 30.0
+
+    def __init__(self, schedule=OK, seed=None, level=12.0, timeout=1.0):
+        self.schedule = parse_schedule(schedule) if isinstance(schedule, str) else list(schedule)
+        self.timeout = timeout
+        self.baudrate = 9600
+        self._rng = random.Random(seed)
+        self.air = Air(level, self._rng)
+        self._buffer = bytearray()
+        self._slot = 0
+
+        self.mode = 'active'
+        self.sleeping = False
+        self.held = False
+        self._started = time.monotonic()
+        self._next = self._started + self.STARTUP_TIME
+
+        # Frames sent by kind and commands received, for tests and benchmarks
+        self.sent = dict.fromkeys(KINDS, 0)
+        self.commands = 0
+
+    def _running(self):
+        return not self.sleeping and not self.held
+
+    def _start(self):
+        self._started = time.monotonic()
+        self._next = self._started + self.STARTUP_TIME
+
+    def _update(self):
+        """
+        Queue the data frames that are due in active mode
+        """
+        if self.mode != 'active' or not self._running():
+            return
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._send_data()
+        self._next += self.FRAME_PERIOD
+        # Don't send a burst of frames after nobody read the port for a while
+        if self._next < now:
+            self._next = now + self.FRAME_PERIOD
+
+    def _send_data(self):
+        """
+        Queue the next data frame of the schedule
+        """
+        if time.monotonic() - self._started < self.STARTUP_TIME:
+            return
+        kind = self.schedule[self._slot]
+        self._slot = (self._slot + 1) % len(self.schedule)
+        self.sent[kind] += 1
+        if kind == SILENT:
+            return
+
+        elapsed = time.monotonic() - self._started
+        warmup = max(0.0, 1 - elapsed / self.WARMUP_TIME)
+        data = data_frame(self.air.values(warmup))
+
+        if kind == CHECKSUM:
+            data = data[:-1] + bytes(((data[-1] + 1) & 0xff,))
+        elif kind == LENGTH:
+            data = data[:2] + struct.pack('>H', 0x0100) + data[4:]
+        elif kind == TRUNCATED:
+            data = data[:len(data) // 2]
+        elif kind == NOISE:
+            data = bytes(self._rng.getrandbits(8) for _ in range(self._rng.randint(1, 40))) + data
+        self._buffer += data
+
+    def set_reset(self, value):
+        """
+        Level of the RESET pin, the sensor stops while it is low
+        """
+        if not value:
+            self.held = True
+            self._buffer.clear()
+        elif self.held:
+            self.held = False
+            self.mode = 'active'
+            self.sleeping = False
+            self._start()
+
+    def set_enable(self, value):
+        """
+        Level of the SET pin, the sensor sleeps while it is low
+        """
+        if not value:
+            self.sleeping = True
+        elif self.sleeping:
+            self.sleeping = False
+            self._start()
+
+    # busio.UART
+
+    @property
+    def in_waiting(self):
+        self._update()
+        return len(self._buffer)
+
+    def readinto(self, buffer, nbytes=None):
+        """
+        Waits up to timeout seconds for the buffer to fill, like the real UART
+        """
+        size = len(buffer) if nbytes is None else nbytes
+        deadline = time.monotonic() + self.timeout
+        self._update()
+        while len(self._buffer) < size and time.monotonic() < deadline:
+            time.sleep(0.01)
+            self._update()
+
+        size = min(size, len(self._buffer))
+        if not size:
+            return None
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+    def read(self, nbytes=None):
+        if nbytes is None:
+            nbytes = self.in_waiting
+        buffer = bytearray(nbytes)
+        size = self.readinto(buffer)
+        return bytes(buffer[:size]) if size else None
+
+    def write(self, data):
+        data = bytes(data)
+        self.commands += 1
+        if len(data) != 7 or data[:2] != SOF or sum(data[:5]) != struct.unpack('>H', data[5:])[0]:
+            return len(data)
+        if self.held:
+            return len(data)
+
+        command, value = data[2], data[4]
+        if command == CMD_SLEEP:
+            if value:
+                self.set_enable(True)
+            else:
+                self._buffer += frame(bytes((CMD_SLEEP, 0)))
+                self.sleeping = True
+        elif self.sleeping:
+            pass
+        elif command == CMD_MODE:
+            self.mode = 'active' if value else 'passive'
+            self._buffer += frame(bytes((CMD_MODE, value)))
+        elif command == CMD_READ and self.mode == 'passive':
+            self._send_data()
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._buffer.clear()
+
+    def deinit(self):
+        pass
@@ -0,0 +1,212 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Run the unmodified firmware on a computer. The modules in this folder stand
+# in for the CircuitPython hardware modules: a simulated PMS5003 and AHT20,
+# LEDs that can be traced, and wifi and socketpool on the computer's network,
+# so the web server and MQTT can be used and profiled end to end.
+#
+# Needs Python 3.11 and the CPython versions of the libraries in lib, which are
+# only there as .mpy files:
+#
+#   pip install adafruit-circuitpython-httpserver adafruit-circuitpython-minimqtt
+#
+#   python3 tools/hostsim/run.py
+#   python3 tools/hostsim/run.py --seconds 60 --set MQTT_ENABLED=1 --set 'MQTT_BROKER="127.0.0.1"'
+#   python3 tools/hostsim/run.py --pms-schedule 'ok*20,checksum,noise,silent*12' --leds
+#   python3 -m cProfile -o code.prof tools/hostsim/run.py --seconds 120
+#
+# boot.py and code.py run like after a power up. Paths on the CIRCUITPY drive
+# (/html, /log and the folders of path settings) are moved to --drive, where
+# html is a link to the html folder of the repository.
+
+import os
+import gc
+import sys
+import signal
+import runpy
+import builtins
+import tempfile
+import argparse
+import tomllib
+
+HOSTSIM = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(HOSTSIM, '..', '..'))
+# The stand-ins have to be found before anything installed with the same name,
+# and the installed libraries before the .mpy packages in lib
+sys.path.insert(0, HOSTSIM)
+sys.path.append(os.path.join(ROOT, 'lib'))
+
+import board
+import busio
+import digitalio
+import socketpool
+import wifi
+from pms5003sim import parse_schedule
+
+# Folders of the CIRCUITPY drive that are moved to --drive
+DRIVE_FOLDERS = {'html', 'log', 'spool'}
+
+
+def parse_value(text):
+    """
+    Parse a settings.toml value, strings need quotes as in the file
+    """
+    return tomllib.loads('value = ' + text)['value']
+
+def load_settings(path, overrides):
+    """
+    Returns settings.toml with the NAME=VALUE overrides applied
+    """
+    with open(path, 'rb') as f:
+        settings = tomllib.load(f)
+    for override in overrides:
+        name, sep, value = override.partition('=')
+        if not sep:
+            raise SystemExit("--set needs NAME=VALUE, got " + override)
+        try:
+            settings[name.strip()] = parse_value(value)
+        except tomllib.TOMLDecodeError as e:
+            raise SystemExit("Invalid value for {}: {}".format(name, e))
+    return settings
+
+def install_settings(settings):
+    """
+    os.getenv reads settings.toml like on CircuitPython. Names that are not in
+    it fall back to the environment, Python itself reads TMPDIR and others.
+    """
+    getenv = os.getenv
+
+    def settings_getenv(key, default=None):
+        if key in settings:
+            return settings[key]
+        return getenv(key, default)
+
+    os.getenv = settings_getenv
+
+def install_drive(drive, settings):
+    """
+    Move absolute paths in the folders of the CIRCUITPY drive to drive
+    """
+    folders = set(DRIVE_FOLDERS)
+    for value in settings.values():
+        if isinstance(value, str) and value.startswith('/') and value.count('/') > 1:
+            folders.add(value.split('/')[1])
+
+    os.makedirs(drive, exist_ok=True)
+    html = os.path.join(drive, 'html')
+    if not os.path.lexists(html):
+        os.symlink(os.path.join(ROOT, 'html'), html)
+
+    def remap(path):
+        if isinstance(path, str) and path.startswith('/') and path.split('/')[1] in folders:
+            return drive + path
+        return path
+
+    def wrap(function):
+        def remapped(*args, **kwargs):
+            return function(*(remap(a) for a in args), **kwargs)
+        return remapped
+
+    builtins.open = wrap(builtins.open)
+    for name in ('stat', 'listdir', 'mkdir', 'rmdir', 'remove', 'rename', 'statvfs'):
+        setattr(os, name, wrap(getattr(os, name)))
+
+def install_gc():
+    """
+    CircuitPython reports its fixed heap with gc.mem_free() and gc.mem_alloc(),
+    CPython has no such heap and they report 0
+    """
+    if not hasattr(gc, 'mem_free'):
+        gc.mem_free = lambda: 0
+        gc.mem_alloc = lambda: 0
+
+def stop_after(seconds):
+    """
+    End the firmware with SystemExit after seconds, profilers still write
+    their output then
+    """
+    def handler(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Pico W Air firmware on a computer")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.toml'),
+                        help="settings file, default the one of the repository")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="override a setting, strings need quotes: --set 'MQTT_BROKER=\"127.0.0.1\"'")
+    parser.add_argument('--drive', default=os.path.join(tempfile.gettempdir(), 'picow-air-drive'),
+                        help="folder standing in for the CIRCUITPY drive")
+    parser.add_argument('--address', default='127.0.0.1', help="address of the web server")
+    parser.add_argument('--http-port', type=int, default=8080, help="port used instead of 80")
+    parser.add_argument('--pms-schedule', default='ok',
+                        help="PMS5003 frames, like 'ok*20,checksum,noise,silent*12'")
+    parser.add_argument('--pm-level', type=float, default=12.0,
+                        help="PM 2.5 level of the simulated air in ug/m3")
+    parser.add_argument('--seed', type=int, help="random seed of the simulated sensors")
+    parser.add_argument('--no-i2c', action='store_true', help="no temperature and humidity sensor")
+    parser.add_argument('--ground', action='append', default=[], metavar='PIN',
+                        help="pin connected to GND, like GP10")
+    parser.add_argument('--leds', action='store_true', help="print every LED and pin change")
+    parser.add_argument('--seconds', type=float, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    try:
+        parse_schedule(args.pms_schedule)
+    except ValueError as e:
+        parser.error(str(e))
+
+    settings = load_settings(args.settings, args.set)
+    install_settings(settings)
+    install_gc()
+    install_drive(os.path.abspath(args.drive), settings)
+
+    busio.PMS5003_SCHEDULE = args.pms_schedule
+    busio.PMS5003_SEED = args.seed
+    busio.PMS5003_LEVEL = args.pm_level
+    busio.I2C_SENSORS = not args.no_i2c
+    digitalio.TRACE = args.leds
+    socketpool.PORTS[80] = args.http_port
+    wifi.radio.ipv4_address = args.address
+    for name in args.ground:
+        getattr(board, name).grounded = True
+
+    print("hostsim: web server on http://{}:{}/, drive in {}".format(
+        args.address, args.http_port, os.path.abspath(args.drive)))
+    if args.seconds:
+        stop_after(args.seconds)
+
+    # CircuitPython runs code.py as __main__ from the root of the drive
+    sys.argv = [os.path.join(ROOT, 'code.py')]
+    runpy.run_path(os.path.join(ROOT, 'boot.py'), run_name='__main__')
+    runpy.run_path(os.path.join(ROOT, 'code.py'), run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Host simulator stand-in for the CircuitPython socketpool module, backed by
+# real sockets. Ports in PORTS are moved when binding, so the web server can
+# listen on 8080 instead of 80 without root, see run.py --http-port.
+
+import socket as _socket
+
+# Port the firmware asks for -> port used on the computer
+PORTS = {}
+
+
+class Socket(_socket.socket):
+    def bind(self, address):
+        host, port = address[:2]
+        super().bind((host, PORTS.get(port, port)))
+
+
+class SocketPool:
+    AF_INET = _socket.AF_INET
+    AF_INET6 = _socket.AF_INET6
+    SOCK_STREAM = _socket.SOCK_STREAM
+    SOCK_DGRAM = _socket.SOCK_DGRAM
+    SOCK_RAW = _socket.SOCK_RAW
+    SOL_SOCKET = _socket.SOL_SOCKET
+    SO_REUSEADDR = _socket.SO_REUSEADDR
+    IPPROTO_TCP = _socket.IPPROTO_TCP
+    IPPROTO_UDP = _socket.IPPROTO_UDP
+    TCP_NODELAY = _socket.TCP_NODELAY
+    EAI_NONAME = _socket.EAI_NONAME
+
+    timeout = _socket.timeout
+    gaierror = _socket.gaierror
+
+    def __init__(self, radio):
+        self.radio = radio
+
+    def socket(self, family=AF_INET, type=SOCK_STREAM, proto=0):
+        sock = Socket(family, type, proto)
+        # Restarting the simulator must not wait for the old port to time out
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        return sock
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        return _socket.getaddrinfo(host, port, family, type, proto, flags)
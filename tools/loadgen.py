@@ -0,0 +1,459 @@
+# MIT License
+
+# Copyright (c) 2023 dphacks.com
+# Copyright (c) 2023 André Costa
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+## Created by André Costa for dphacks.com
+
+# Load generator for the MQTT broker and tools/aggregator.py. Simulates DEVICES
+# boards, each publishing a measurement every INTERVAL seconds. Measurements
+# are made the way code.py makes them: PMS5003 data frames of simulated air
+# parsed by the driver, averaged, smoothed, with the AQI added, and published
+# as JSON or in batches with dphacks_payload. Runs on a computer with aiomqtt:
+#
+#   pip install aiomqtt
+#   python3 tools/loadgen.py --devices 1000 --interval 5 --seconds 60
+#   python3 tools/loadgen.py --devices 20000 --processes 4 --encoding binary --batch 12
+#
+# Every board publishes to <topic>/<worker>/<device>. The generator also
+# subscribes to the topics of its boards and reports the publish rate it
+# reached, the rate messages came back from the broker and the time they
+# took, matched by their content. --output saves the summary as JSON.
+
+import os
+import sys
+import json
+import time
+import heapq
+import asyncio
+import array
+import queue
+import random
+import argparse
+import threading
+import collections
+import multiprocessing
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, '..', 'lib'))
+sys.path.insert(0, os.path.join(TOOLS, 'hostsim'))
+
+import dphacks_usaqi as USAQI
+import dphacks_sample as SAMPLE
+import dphacks_payload as PAYLOAD
+from dphacks_sample import Sample
+from dphacks_smooth import Smoother
+from pms5003 import PMS5003Data
+from pms5003sim import Air, data_frame
+
+SMOOTH = 5
+# Latencies kept per report, a random sample of them beyond this
+LATENCY_SAMPLES = 20000
+# Messages waiting for their echo from the broker, older ones count as lost
+PENDING_MAX_AGE = 30
+
+
+class VirtualDevice:
+    """
+    One simulated board
+    """
+
+    def __init__(self, topic, rng, encoding, batch, frames):
+        self.topic = topic
+        self.frames = frames
+        self.air = Air(rng.uniform(3, 40), rng)
+        self.rng = rng
+        self.temperature = rng.uniform(18, 26)
+        self.humidity = rng.uniform(30, 60)
+
+        self.smoother = Smoother(SMOOTH, SAMPLE.NUM_FIELDS, SAMPLE.SCALES)
+        self.sample = Sample()
+        self.averaged = Sample()
+        self.sums = array.array('L', [0] * SAMPLE.PM_COUNT)
+        self.frame = memoryview(bytearray(PMS5003Data.FRAME_LEN))
+
+        self.batch = None
+        if batch > 1 or encoding != PAYLOAD.JSON:
+            self.batch = PAYLOAD.Batch(batch, encoding)
+            self.row = array.array('f', [0.0] * PAYLOAD.NUM_COLUMNS)
+
+    def read_pms5003(self):
+        """
+        Average the data frames of an interval into the sample, like
+        poll_pms25 and finish_pms25 in code.py
+        """
+        sums = self.sums
+        frame = self.frame
+        for _ in range(self.frames):
+            frame[:] = data_frame(self.air.values())
+            data = PMS5003Data(frame[4:], frame_length_bytes=frame[2:4]).data
+            for i in range(SAMPLE.PM_COUNT):
+                sums[i] += data[i]
+        for i in range(SAMPLE.PM_COUNT):
+            self.sample.set(i, sums[i] / self.frames)
+            sums[i] = 0
+
+    def read_all(self):
+        self.read_pms5003()
+        self.temperature += self.rng.gauss(0, 0.05)
+        self.humidity += self.rng.gauss(0, 0.2)
+        self.sample.set(SAMPLE.TEMPERATURE, self.temperature)
+        self.sample.set(SAMPLE.HUMIDITY, self.humidity)
+        return self.sample
+
+    def measure(self, now):
+        """
+        Take a measurement, like measure() in code.py. Returns the payload to
+        publish, or None while a batch is filling up.
+        """
+        self.smoother.add(self.read_all())
+        averaged = self.smoother.average_into(self.averaged)
+        message = averaged.to_dict()
+
+        values = averaged.values
+        overall, pm25_index, pm100_index = USAQI.pm_aqi(round(values[SAMPLE.PM25_ENV]),
+                                                        round(values[SAMPLE.PM100_ENV]))
+        aqi = USAQI.aqi_info(overall)
+        aqi['aqi pm25'] = pm25_index
+        aqi['aqi pm100'] = pm100_index
+        message.update(aqi)
+
+        if self.batch is None:
+            return json.dumps(message).encode()
+
+        row = self.row
+        for i in range(SAMPLE.NUM_FIELDS):
+            row[i] = values[i]
+        valid = averaged.valid
+        for column in range(SAMPLE.NUM_FIELDS, PAYLOAD.NUM_COLUMNS):
+            value = message.get(PAYLOAD.COLUMNS[column])
+            if value is not None:
+                row[column] = value
+                valid |= 1 << column
+        self.batch.add(int(now), row, valid)
+        if not self.batch.full():
+            return None
+        payload = self.batch.encode()
+        self.batch.clear()
+        return payload if isinstance(payload, bytes) else payload.encode()
+
+
+class Stats:
+    """
+    Counts of a worker since its last report
+    """
+
+    def __init__(self):
+        self.published = 0
+        self.failed = 0
+        self.disconnects = 0
+        self.received = 0
+        self.lost = 0
+        self.latencies = []
+        self._seen = 0
+
+    def latency(self, seconds):
+        # Reservoir sample, so a report stays small at any rate
+        self._seen += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(seconds)
+        else:
+            slot = random.randrange(self._seen)
+            if slot < LATENCY_SAMPLES:
+                self.latencies[slot] = seconds
+
+    def report(self, worker):
+        counts = {'worker': worker, 'published': self.published, 'failed': self.failed,
+                  'disconnects': self.disconnects, 'received': self.received, 'lost': self.lost, 'latencies': self.latencies}
+        self.__init__()
+        return counts
+
+
+class Worker:
+    """
+    Publishes for a share of the devices over a few connections and
+    listens for the messages coming back
+    """
+
+    def __init__(self, index, args, devices):
+        self.index = index
+        self.args = args
+        self.stats = Stats()
+        # (topic, payload) -> send times of messages waiting for their echo
+        self.pending = {}
+        self.pending_count = 0
+        rng = random.Random(args.seed * 1000 + index if args.seed is not None else None)
+        self.devices = [VirtualDevice('{}/{}/{}'.format(args.topic, index, n), rng,
+                                      args.encoding, args.batch, args.frames)
+                        for n in devices]
+        self.rng = rng
+
+    def next_time(self, now):
+        jitter = self.args.interval * self.args.jitter
+        return now + self.args.interval + self.rng.uniform(-jitter, jitter)
+
+    def client(self, **kwargs):
+        import aiomqtt
+        return aiomqtt.Client(self.args.host, self.args.port, username=self.args.username,
+                              password=self.args.password, **kwargs)
+
+    async def connected(self, run, *args):
+        """
+        Keep run(client, *args) going, reconnecting when the broker drops
+        the connection
+        """
+        import aiomqtt
+
+        while True:
+            try:
+                async with self.client(max_queued_outgoing_messages=0) as client:
+                    await run(client, *args)
+            except aiomqtt.MqttError:
+                self.stats.disconnects += 1
+                await asyncio.sleep(1)
+
+    async def publisher(self, client, devices, schedule):
+        """
+        Publish for devices on one connection, each at its own interval
+        """
+        import aiomqtt
+
+        if not schedule:
+            # Spread the first measurements over an interval
+            start = time.monotonic()
+            schedule.extend((start + self.rng.uniform(0, self.args.interval), n)
+                            for n in range(len(devices)))
+            heapq.heapify(schedule)
+        while True:
+            when, n = schedule[0]
+            delay = when - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            device = devices[n]
+            now = time.monotonic()
+            heapq.heapreplace(schedule, (self.next_time(max(when, now - self.args.interval)), n))
+
+            payload = device.measure(time.time())
+            if payload is None:
+                continue
+            if self.args.latency:
+                self.track(device.topic, payload, now)
+            try:
+                await client.publish(device.topic, payload, qos=self.args.qos)
+                self.stats.published += 1
+            except aiomqtt.MqttError:
+                self.stats.failed += 1
+
+    def track(self, topic, payload, now):
+        if self.pending_count >= LATENCY_SAMPLES * 10:
+            return
+        self.pending.setdefault((topic, payload), collections.deque()).append(now)
+        self.pending_count += 1
+
+    async def listener(self, client):
+        """
+        Match the messages coming back from the broker to their send times
+        """
+        await client.subscribe('{}/{}/#'.format(self.args.topic, self.index), qos=self.args.qos)
+        async for message in client.messages:
+            now = time.monotonic()
+            key = (str(message.topic), bytes(message.payload))
+            sent = self.pending.get(key)
+            if not sent:
+                continue
+            self.stats.received += 1
+            self.stats.latency(now - sent.popleft())
+            self.pending_count -= 1
+            if not sent:
+                del self.pending[key]
+
+    def expire(self):
+        """
+        Count the messages that didn't come back in time as lost
+        """
+        oldest = time.monotonic() - PENDING_MAX_AGE
+        for key in list(self.pending):
+            sent = self.pending[key]
+            while sent and sent[0] < oldest:
+                sent.popleft()
+                self.pending_count -= 1
+                self.stats.lost += 1
+            if not sent:
+                del self.pending[key]
+
+    async def run(self, report):
+        listener = None
+        if self.args.latency:
+            listener = asyncio.create_task(self.connected(self.listener))
+            # Let the subscription settle before the first message is sent
+            await asyncio.sleep(0.5)
+        connections = max(1, min(self.args.connections, len(self.devices)))
+        tasks = [asyncio.create_task(self.connected(self.publisher, self.devices[c::connections], []))
+                 for c in range(connections)]
+        if listener is not None:
+            tasks.append(listener)
+
+        end = time.monotonic() + self.args.seconds
+        while time.monotonic() < end:
+            await asyncio.sleep(min(self.args.stats, end - time.monotonic()))
+            failed = [task for task in tasks if task.done()]
+            if failed:
+                for task in failed:
+                    print("Worker {} stopped: {!r}".format(self.index, task.exception()))
+                break
+            self.expire()
+            report(self.stats.report(self.index))
+
+        for task in tasks:
+            if task is not listener:
+                task.cancel()
+        # Give the last messages time to come back
+        if listener is not None:
+            await asyncio.sleep(1)
+            listener.cancel()
+        report(self.stats.report(self.index))
+
+
+def run_worker(index, args, devices, reports):
+    worker = Worker(index, args, devices)
+    try:
+        asyncio.run(worker.run(reports.put))
+    finally:
+        reports.put(None)
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 2)
+    return {'p50_ms': pick(50), 'p90_ms': pick(90), 'p99_ms': pick(99),
+            'max_ms': round(latencies[-1] * 1000, 2)}
+
+def collect(reports, workers, args):
+    """
+    Print the merged reports of the workers once all of them reported,
+    every --stats seconds. Returns the summary of the whole run.
+    """
+    target = args.devices / args.interval / (args.batch if args.batch > 1 else 1)
+    totals = dict(published=0, failed=0, disconnects=0, received=0, lost=0)
+    latencies = []
+    period = dict(totals)
+    period_latencies = []
+    running = workers
+    reported = 0
+    start = last = time.monotonic()
+
+    while running:
+        report = reports.get()
+        if report is None:
+            running -= 1
+        else:
+            for name in totals:
+                period[name] += report[name]
+            period_latencies.extend(report['latencies'])
+            reported += 1
+
+        if reported and reported >= running:
+            reported = 0
+            now = time.monotonic()
+            elapsed = now - last
+            print("{:.0f}/s published (target {:.0f}/s), {:.0f}/s back, {} failed, {} disconnects, {} lost, "
+                  "latency {}".format(period['published'] / elapsed, target, period['received'] / elapsed,
+                                      period['failed'], period['disconnects'], period['lost'],
+                ' '.join('{}={}'.format(k, v) for k, v in percentiles(period_latencies).items())))
+            for name in totals:
+                totals[name] += period[name]
+                period[name] = 0
+            latencies.extend(period_latencies)
+            if len(latencies) > LATENCY_SAMPLES * 10:
+                latencies = random.sample(latencies, LATENCY_SAMPLES * 5)
+            period_latencies = []
+            last = now
+
+    elapsed = time.monotonic() - start
+    summary = {
+        'devices': args.devices,
+        'interval': args.interval,
+        'encoding': args.encoding,
+        'batch': args.batch,
+        'seconds': round(elapsed, 1),
+        'target_rate': round(target, 1),
+        'publish_rate': round(totals['published'] / elapsed, 1),
+        'receive_rate': round(totals['received'] / elapsed, 1),
+    }
+    summary.update(totals)
+    summary.update(percentiles(latencies))
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of Pico W Air boards publishing to MQTT")
+    parser.add_argument('--host', default='127.0.0.1', help="MQTT broker")
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--topic', default='loadgen', help="topic prefix of the boards")
+    parser.add_argument('--devices', type=int, default=100, help="number of boards")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between measurements, INTERVAL")
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help="random change of every interval, as a fraction of it")
+    parser.add_argument('--frames', type=int, default=1, help="PMS5003 frames averaged per measurement")
+    parser.add_argument('--encoding', default=PAYLOAD.JSON, choices=PAYLOAD.ENCODINGS)
+    parser.add_argument('--batch', type=int, default=1, help="measurements per message, MQTT_BATCH")
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--connections', type=int, default=50,
+                        help="MQTT connections per process the boards share")
+    parser.add_argument('--processes', type=int, default=1, help="processes the boards are split over")
+    parser.add_argument('--no-latency', dest='latency', action='store_false',
+                        help="don't subscribe to measure the latency")
+    parser.add_argument('--seconds', type=float, default=60, help="length of the run")
+    parser.add_argument('--stats', type=float, default=5, help="seconds between reports")
+    parser.add_argument('--seed', type=int, help="random seed of the simulated air")
+    parser.add_argument('-o', '--output', help="save the summary to this JSON file")
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        reports = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_worker, args=(
+                       i, args, range(i, args.devices, args.processes), reports), daemon=True)
+                   for i in range(args.processes)]
+    else:
+        reports = queue.Queue()
+        workers = [threading.Thread(target=run_worker, args=(0, args, range(args.devices), reports),
+                                    daemon=True)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        summary = collect(reports, len(workers), args)
+    except KeyboardInterrupt:
+        return 1
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())